@@ -40,7 +40,8 @@ class BasicSimulator:
             target_ip=transmission_config.get('targetIP', '10.0.0.67'),
             target_port=transmission_config.get('targetPort', 7000),
             sensor_id=self.config.get('sensor', {}).get('id', 1),
-            nodes_per_packet=self.config.get('sensor', {}).get('nodesPerPacket', 256)
+            nodes_per_packet=self.config.get('sensor', {}).get('nodesPerPacket', 256),
+            transport="udp" if transmission_config.get('protocol') == "wifi-udp" else "tcp"
         )
         
         # 设置帧率
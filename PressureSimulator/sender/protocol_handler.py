@@ -4,6 +4,7 @@
 """
 
 import struct
+import binascii
 import numpy as np
 from typing import List, Tuple, Dict, Any
 
@@ -82,13 +83,15 @@ class ProtocolHandler:
             print(f"数据包解码错误: {e}")
             raise
     
-    def split_pressure_data(self, pressure_1d: np.ndarray, sensor_id: int = 1) -> List[Tuple[bytes, Dict[str, Any]]]:
+    def split_pressure_data(self, pressure_1d: np.ndarray, sensor_id: int = 1,
+                            first_packet_num: int = 0) -> List[Tuple[bytes, Dict[str, Any]]]:
         """
         将1024节点的压力数据分成多个数据包
         
         Args:
             pressure_1d: 1024长度的1D压力数组
             sensor_id: 传感器ID
+            first_packet_num: 第一个数据包的编号
             
         Returns:
             [(packet_bytes, packet_info), ...] 列表
@@ -97,7 +100,7 @@ class ProtocolHandler:
             print(f"警告: 压力数据长度({len(pressure_1d)})不是每包节点数({self.nodes_per_packet})的整数倍")
         
         packets = []
-        packet_count = 0
+        packet_count = first_packet_num
         
         for i in range(0, len(pressure_1d), self.nodes_per_packet):
             # 提取当前包的数据
@@ -212,15 +215,61 @@ class WifiProtocolHandler(ProtocolHandler):
         return tcp_packets
 
 
+    def prepare_udp_data(self, sensor_id: int, pressure_1d: np.ndarray, first_packet_num: int) -> List[bytes]:
+        """
+        准备UDP传输的数据包（每包一个数据报，包编号跨帧连续递增，接收端据此检测丢包和乱序）
+        
+        Args:
+            sensor_id: 传感器ID
+            pressure_1d: 1024长度的压力数据
+            first_packet_num: 第一个数据包的编号
+            
+        Returns:
+            准备好的UDP数据包列表
+        """
+        packets = self.split_pressure_data(pressure_1d, sensor_id, first_packet_num)
+        return [packet_bytes for packet_bytes, packet_info in packets]
+
+
 class SerialProtocolHandler(ProtocolHandler):
     """串口协议处理器，继承基础协议处理器"""
     
-    def __init__(self, nodes_per_packet: int = 256):
+    # 长度前缀帧格式：同步字(0xA5 0x5A) + 长度(uint16小端) + 数据包 + 可选CRC-16/CCITT(长度+数据包)
+    SYNC_WORD = b'\xa5\x5a'
+    
+    def __init__(self, nodes_per_packet: int = 256, framing: str = "delimiter", checksum: bool = False):
+        """
+        Args:
+            nodes_per_packet: 每包节点数
+            framing: 帧格式，"delimiter"（以b'wr'结尾）或"length"（长度前缀）
+            checksum: 长度前缀帧是否附加CRC校验
+        """
         super().__init__(nodes_per_packet)
+        self.framing = framing
+        self.checksum = checksum
+    
+    def encode_serial_frame(self, packet_bytes: bytes) -> bytes:
+        """
+        按配置的帧格式封装单个数据包
+        
+        Args:
+            packet_bytes: 编码后的数据包
+            
+        Returns:
+            串口帧字节数据
+        """
+        if self.framing != "length":
+            return packet_bytes + b'wr'
+        
+        body = struct.pack('<H', len(packet_bytes)) + packet_bytes
+        frame = self.SYNC_WORD + body
+        if self.checksum:
+            frame += struct.pack('<H', binascii.crc_hqx(body, 0xFFFF))
+        return frame
     
     def prepare_serial_data(self, sensor_id: int, pressure_1d: np.ndarray) -> List[bytes]:
         """
-        准备串口传输的数据包（可能需要添加特殊的帧头/帧尾）
+        准备串口传输的数据包（按配置添加帧头/帧尾）
         
         Args:
             sensor_id: 传感器ID
@@ -233,8 +282,7 @@ class SerialProtocolHandler(ProtocolHandler):
         serial_packets = []
         
         for packet_bytes, packet_info in packets:
-            # 可以在这里添加串口特定的帧格式
-            serial_packets.append(packet_bytes)
+            serial_packets.append(self.encode_serial_frame(packet_bytes))
         
         return serial_packets
 
@@ -1,6 +1,6 @@
 """
 WiFi数据发送器
-模拟ESP32通过TCP发送压力数据到WiReSensPy系统
+模拟ESP32通过TCP或UDP发送压力数据到WiReSensPy系统
 """
 
 import socket
@@ -13,10 +13,10 @@ import numpy as np
 from .protocol_handler import WifiProtocolHandler
 
 class WifiSender:
-    """WiFi TCP数据发送器"""
+    """WiFi TCP/UDP数据发送器"""
     
     def __init__(self, target_ip: str = "10.0.0.67", target_port: int = 7000,
-                 sensor_id: int = 1, nodes_per_packet: int = 256):
+                 sensor_id: int = 1, nodes_per_packet: int = 256, transport: str = "tcp"):
         """
         初始化WiFi发送器
         
@@ -25,11 +25,16 @@ class WifiSender:
             target_port: 目标端口
             sensor_id: 传感器ID
             nodes_per_packet: 每包节点数
+            transport: 传输方式，"tcp" 或 "udp"（对应WiReSensPy的"wifi-udp"协议）
         """
         self.target_ip = target_ip
         self.target_port = target_port
         self.sensor_id = sensor_id
         self.nodes_per_packet = nodes_per_packet
+        self.transport = transport
+        
+        # UDP包编号跨帧连续递增
+        self.packet_number = 0
         
         # 协议处理器
         self.protocol_handler = WifiProtocolHandler(nodes_per_packet)
@@ -78,6 +83,14 @@ class WifiSender:
             连接是否成功
         """
         try:
+            if self.transport == "udp":
+                # UDP无连接，connect仅设置默认目标地址
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.socket.connect((self.target_ip, self.target_port))
+                self.connected = True
+                self.logger.info(f"UDP发送目标: {self.target_ip}:{self.target_port}")
+                return True
+            
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(timeout)
             
@@ -156,16 +169,26 @@ class WifiSender:
                 return False
             
             # 分包并发送
-            tcp_packets = self.protocol_handler.prepare_tcp_data(self.sensor_id, pressure_1d)
+            if self.transport == "udp":
+                packets = self.protocol_handler.prepare_udp_data(self.sensor_id, pressure_1d, self.packet_number)
+                self.packet_number += len(packets)
+            else:
+                packets = self.protocol_handler.prepare_tcp_data(self.sensor_id, pressure_1d)
             
-            for i, packet_bytes in enumerate(tcp_packets):
+            for i, packet_bytes in enumerate(packets):
                 # 发送数据包
-                self.socket.send(packet_bytes)
+                try:
+                    self.socket.send(packet_bytes)
+                except ConnectionRefusedError:
+                    # UDP接收端未启动时会收到ICMP端口不可达，丢弃该包继续发送
+                    if self.transport != "udp":
+                        raise
+                    continue
                 self.packets_sent += 1
                 self.bytes_sent += len(packet_bytes)
                 
                 # 包间延迟
-                if i < len(tcp_packets) - 1 and self.packet_delay > 0:
+                if i < len(packets) - 1 and self.packet_delay > 0:
                     time.sleep(self.packet_delay)
             
             self.frames_sent += 1
@@ -274,6 +297,7 @@ class WifiSender:
             'connected': self.connected,
             'running': self.running,
             'target': f"{self.target_ip}:{self.target_port}",
+            'transport': self.transport,
             'sensor_id': self.sensor_id,
             'frames_sent': self.frames_sent,
             'packets_sent': self.packets_sent,
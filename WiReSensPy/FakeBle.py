@@ -0,0 +1,120 @@
+import asyncio
+import os
+import sys
+import tempfile
+import numpy as np
+from PacketLog import PacketLog, readPacketLog
+
+# Stand-ins for bleak's BleakScanner and BleakClient that replay recorded notifications, so BLEReceiver's queue and
+# batch path can run without hardware: BLEReceiver(..., scanner=FakeScanner(names), clientFactory=fakeClients(...)).
+
+def recordedNotifications(logPath):
+    # The raw packets of a packet log (PacketLog.py), one notification each
+    records = readPacketLog(logPath)
+    return [record.tobytes() for record in records['packet']]
+
+class FakeDevice():
+    def __init__(self, name):
+        self.name = name
+
+class FakeScanner():
+    def __init__(self, deviceNames):
+        self.devices = {name: FakeDevice(name) for name in deviceNames}
+
+    async def find_device_by_name(self, name, timeout=None):
+        return self.devices.get(name)
+
+class FakeBleakClient():
+    # Replays notifications to the start_notify handler. With burst, all of them are delivered without yielding to
+    # the event loop, as when the radio hands over a backlog faster than it can be consumed.
+    def __init__(self, device, notifications, burst=False):
+        self.device = device
+        self.notifications = notifications
+        self.burst = burst
+        self.replay = None
+        self.connected = False
+
+    def set_disconnected_callback(self, callback):
+        self.disconnectedCallback = callback
+
+    async def connect(self):
+        self.connected = True
+
+    async def start_notify(self, uuid, handler):
+        self.replay = asyncio.create_task(self.replayNotifications(handler))
+
+    async def replayNotifications(self, handler):
+        for data in self.notifications:
+            handler(None, bytearray(data))
+            if not self.burst:
+                await asyncio.sleep(0)
+
+    async def stop_notify(self, uuid):
+        if self.replay is not None:
+            await self.replay
+
+    async def disconnect(self):
+        self.connected = False
+
+def fakeClients(notifications, burst=False):
+    # clientFactory for BLEReceiver; notifications maps device name to the packets it replays
+    return lambda device: FakeBleakClient(device, notifications[device.name], burst)
+
+
+def syntheticLog(path, sendId, numNodes, pressureLength, packets):
+    # Writes a packet log of consecutive packets covering the frame numNodes readings at a time
+    packetDtype = np.dtype([('sendId', np.int8), ('startIdx', '<u2'), ('readings', '<u2', (numNodes,)), ('packet', '<u4')])
+    records = np.zeros(packets, dtype=packetDtype)
+    records['sendId'] = sendId
+    records['startIdx'] = np.arange(packets)*numNodes % pressureLength
+    records['readings'] = (np.arange(packets)[:, None]*7+np.arange(numNodes)) % 4096
+    records['packet'] = np.arange(1, packets+1)
+    log = PacketLog(path, 'ble')
+    log.append(records, np.arange(packets, dtype=np.float64))
+    log.close()
+
+async def replayCheck(logPath, sensorId=1, selWires=16, readWires=16, numNodes=100, queueSize=256, burst=False):
+    # Runs BLEReceiver on a recorded log and returns (receiver, sensor, reference sensor fed the same packets directly)
+    from Sensor import Sensor
+    from TouchSensorWireless import BLEReceiver
+    notifications = recordedNotifications(logPath)
+    sensor = Sensor(selWires, readWires, numNodes, sensorId, deviceName="Fake1")
+    reference = Sensor(selWires, readWires, numNodes, sensorId)
+    receiver = BLEReceiver(numNodes, [sensor], record=False, queueSize=queueSize,
+                           scanner=FakeScanner([sensor.deviceName]), clientFactory=fakeClients({sensor.deviceName: notifications}, burst))
+    tasks = asyncio.gather(*receiver.startReceiverThreads())
+    # Let every device connect and replay its notifications before stopping
+    while len(receiver.clients) < len(receiver.deviceNames) or not all(client.replay is not None and client.replay.done() for client in receiver.clients.values()):
+        await asyncio.sleep(0.01)
+    await receiver.stopReceiver()
+    # The None sentinel queued by stopReceiver ends each consumer, so every receiver task finishes
+    await asyncio.wait_for(tasks, timeout=5)
+    # The reference sees every packet in order, as the receiver does when nothing is dropped
+    packets = receiver.unpackBytesPackets(b''.join(notifications))
+    for startIdx, readings, packet in zip(packets['startIdx'].tolist(), packets['readings'], packets['packet'].tolist()):
+        reference.processRow(startIdx, readings, packet, record=False)
+    return receiver, sensor, reference
+
+
+if __name__ == "__main__":
+    # python FakeBle.py [log.wrlog]: replays a BLE packet log (or a synthetic one) through BLEReceiver and checks that
+    # every frame is assembled, that a small queue overflows by exactly what it could not hold, and that stopping ends
+    # the consumer
+    with tempfile.TemporaryDirectory() as directory:
+        logPath = sys.argv[1] if len(sys.argv) > 1 else os.path.join(directory, "fake.wrlog")
+        if len(sys.argv) == 1:
+            syntheticLog(logPath, 1, 100, 256, 512)
+        count = len(recordedNotifications(logPath))
+
+        receiver, sensor, reference = asyncio.run(replayCheck(logPath))
+        assert sensor.fc == reference.fc > 0, (sensor.fc, reference.fc)
+        assert np.array_equal(sensor.pressure, reference.pressure)
+        assert sum(receiver.queueOverflows.values()) == 0 and receiver.queueDepths() == {sensor.deviceName: 0}
+        print(f"Replayed {count} notifications: {sensor.fc} frames assembled, no overflows")
+
+        queueSize = 16
+        receiver, sensor, reference = asyncio.run(replayCheck(logPath, queueSize=queueSize, burst=True))
+        overflows = receiver.queueOverflows[sensor.deviceName]
+        assert overflows == count-queueSize, (overflows, count-queueSize)
+        assert receiver.queueDepths() == {sensor.deviceName: 0}
+        print(f"Burst into a queue of {queueSize}: {overflows} overflows, {sensor.fc} frames assembled from the newest packets")
@@ -0,0 +1,48 @@
+import numpy as np
+
+class FrameHistory():
+    # Fixed-size ring of the last N frames, preallocated as one (N, selWires, readWires) uint16 array with per-frame
+    # timestamps and predicted flags. The arrays can be placed in a caller-provided buffer (e.g. shared memory).
+    def __init__(self, size, selWires, readWires, buffer=None, offset=0):
+        self.size = size
+        self.selWires = selWires
+        self.readWires = readWires
+        if buffer is None:
+            buffer = bytearray(FrameHistory.nbytes(size, selWires, readWires))
+            offset = 0
+        frameBytes = 2*selWires*readWires
+        self.count = np.ndarray((1,), dtype=np.int64, buffer=buffer, offset=offset) # frame count of the newest frame
+        self.ts = np.ndarray((size,), dtype=np.float64, buffer=buffer, offset=offset+8)
+        self.frames = np.ndarray((size, selWires, readWires), dtype=np.uint16, buffer=buffer, offset=offset+8+8*size)
+        self.predicted = np.ndarray((size,), dtype=np.bool_, buffer=buffer, offset=offset+8+8*size+frameBytes*size)
+        self.scratch = np.empty((selWires, readWires))
+
+    @staticmethod
+    def nbytes(size, selWires, readWires):
+        return 8 + 8*size + 2*selWires*readWires*size + size
+
+    def append(self, frame, fc, ts, predicted=False):
+        if self.size == 0:
+            return
+        slot = (fc-1)%self.size
+        # Predictions can overshoot the uint16 range
+        np.clip(frame.reshape(self.selWires, self.readWires), 0, 65535, out=self.scratch)
+        np.copyto(self.frames[slot], self.scratch, casting='unsafe')
+        self.ts[slot] = ts
+        self.predicted[slot] = predicted
+        self.count[0] = fc
+
+    def since(self, seq, copy=False):
+        # Frames newer than frame count seq that are still in the ring, oldest first: (frames, ts, predicted, first frame count).
+        # Views into the ring are returned when the range does not wrap, and stay valid until the ring overwrites them;
+        # otherwise (or with copy=True) a single contiguous copy is made.
+        newest = int(self.count[0])
+        first = max(seq+1, newest-self.size+1, 1)
+        if self.size == 0 or first > newest:
+            return self.frames[:0], self.ts[:0], self.predicted[:0], first
+        start = (first-1)%self.size
+        stop = start+newest-first+1
+        if stop <= self.size and not copy:
+            return self.frames[start:stop], self.ts[start:stop], self.predicted[start:stop], first
+        idx = np.arange(first-1, newest)%self.size
+        return self.frames[idx], self.ts[idx], self.predicted[idx], first
@@ -1,7 +1,9 @@
 import numpy as np
 import time
-import struct
 from Sensor import Sensor
+from RingBuffer import RingBuffer
+from PacketLog import PacketLog, logPathFor
+import utils
 from matplotlib import pyplot as plt
 from matplotlib import animation
 import aioconsole
@@ -9,21 +11,36 @@ import asyncio
 from typing import List
 
 class GenericReceiverClass():
-    def __init__(self, numNodes, sensors: List[Sensor], record):
+    TRANSPORT = None # transport name recorded in packet logs, set by each receiver
+    # Display range of the readings, also used to quantize visualization streams (vizOptions.codec)
+    pressure_min = 0
+    pressure_max = 4096
+    use_log = True
+
+    def __init__(self, numNodes, sensors: List[Sensor], record, framing="delimiter", checksum=False):
         self.frameRate = None
         self.startTime = time.time()
         self.numNodes = numNodes
+        self.packetSize = 1+(1+numNodes)*2+4
+        # Packed little-endian packet layout, equivalent to struct format '=b' + 'H'*(1+numNodes) + 'I'
+        self.packetDtype = np.dtype([('sendId', np.int8), ('startIdx', '<u2'), ('readings', '<u2', (numNodes,)), ('packet', '<u4')])
         self.sensors = {sensor.id: sensor for sensor in sensors}
         self.caxs = []
 
         self.record = record
-        self.pressure_min = 0
-        self.pressure_max = 4096
-        self.use_log = True
 
-        self.partialData = b''
+        self.framing = framing
+        self.checksum = checksum
+        self.ring = RingBuffer(self.packetSize*64)
         self.buffer = asyncio.Queue()
 
+        # Sensors recorded with the packetlog backend get their raw packets appended to a log instead of frames to HDF5
+        self.packetLogs = {}
+        if record:
+            for sensor in sensors:
+                if sensor.logPackets:
+                    self.packetLogs[sensor.id] = PacketLog(logPathFor(sensor.path), self.TRANSPORT)
+
     def startReceiver(self):
         raise NotImplementedError("Receivers must implement a startReceiver method")
     async def stopReceiver(self):
@@ -31,30 +48,77 @@ class GenericReceiverClass():
     
 
     def unpackBytesPacket(self, byteString):
-        format_string = '=b' + 'H' * (1+self.numNodes) + 'I'  # 'b' for int8_t, 'H' for uint16_t
-        tupData = struct.unpack(format_string,byteString)
-        sendId = tupData[0]
-        startIdx = tupData[1]
-        sensorReadings = tupData[2:-1]
-        packetNumber = tupData[-1]
+        # sensorReadings is a uint16 view into byteString, so it is only valid until the buffer is reused
+        packet = np.frombuffer(byteString, dtype=self.packetDtype, count=1)[0]
+        sendId = int(packet['sendId'])
+        startIdx = int(packet['startIdx'])
+        sensorReadings = packet['readings']
+        packetNumber = int(packet['packet'])
         return sendId, startIdx,sensorReadings, packetNumber
 
+    def unpackBytesPackets(self, byteString):
+        # Decodes a buffer of back-to-back packets into a structured array with one record per packet
+        return np.frombuffer(byteString, dtype=self.packetDtype, count=len(byteString)//self.packetSize)
+
+    def logPackets(self, packets):
+        # packets is a structured array of received packets; called before they are dispatched
+        if not self.packetLogs:
+            return
+        ts = utils.getUnixTimestamp()
+        sendIds = packets['sendId']
+        if len(sendIds) > 0 and (sendIds == sendIds[0]).all():
+            packetLog = self.packetLogs.get(int(sendIds[0]))
+            if packetLog is not None:
+                packetLog.append(packets, ts)
+            return
+        for sensorId, packetLog in self.packetLogs.items():
+            mask = sendIds == sensorId
+            if mask.any():
+                packetLog.append(packets[mask], ts)
+
+    def closePacketLogs(self):
+        for packetLog in self.packetLogs.values():
+            packetLog.close()
+
+    def dispatchPacket(self, sendId, startIdx, readings, packet):
+        sensor = self.sensors[sendId]
+        if(sensor.intermittent):
+            sensor.processRowIntermittent(startIdx,readings,packet,record=self.record)
+        else:
+            if (startIdx==20000):
+                sensor.processRowReadNode(readings,packet,record=self.record)
+            else:
+                sensor.processRow(startIdx,readings,packet,record=self.record)
+
+    def dispatchPackets(self, packets):
+        readings = packets['readings']
+        for i, (sendId, startIdx, packet) in enumerate(zip(packets['sendId'].tolist(), packets['startIdx'].tolist(), packets['packet'].tolist())):
+            self.dispatchPacket(sendId, startIdx, readings[i], packet)
+
     async def process_line(self, line):
-        if len(line) == 1+(1+self.numNodes)*2+4:
+        if len(line) == self.packetSize:
+            self.logPackets(self.unpackBytesPackets(line))
             sendId, startIdx, readings, packetID = self.unpackBytesPacket(line)
             sensor = self.sensors[sendId]
             await sensor.processRowAsync(startIdx, readings, packetID)
+        else:
+            self.ring.dropped += 1
 
     async def read_lines(self):
         print("Reading lines")
         while not self.stopFlag.is_set():
             data = await self.buffer.get()
-            self.partialData += data
-            lines = self.partialData.split(b'wr')
-            self.partialData = lines.pop()
+            self.ring.write(data)
+            if self.framing == "length":
+                lines = self.ring.lengthPrefixedPackets(self.packetSize, self.checksum)
+            else:
+                lines = self.ring.delimitedPackets(b'wr')
             for line in lines:
                 await self.process_line(line)
 
+    def framingStats(self):
+        return {'frames': self.ring.frames, 'dropped': self.ring.dropped, 'resyncs': self.ring.resyncs, 'overflows': self.ring.overflows}
+
     async def listen_for_stop(self):
         print("Listening for stop")
         while not self.stopFlag.is_set():
@@ -0,0 +1,144 @@
+import atexit
+import os
+import sys
+import time
+import multiprocessing
+import numpy as np
+
+# Each record is a fixed 12-byte header followed by the raw packet bytes
+RECORD_HEADER = np.dtype([('ts', '<f8'), ('transport', 'u1'), ('sendId', 'i1'), ('length', '<u2')])
+TRANSPORTS = {'wifi': 0, 'wifi-udp': 1, 'ble': 2, 'serial': 3}
+
+def recordDtype(length):
+    return np.dtype([('header', RECORD_HEADER), ('packet', 'V%d' % length)])
+
+def logPathFor(path):
+    return os.path.splitext(path)[0]+'.wrlog'
+
+class PacketLog():
+    # Append-only log of the raw packets received for one sensor. Records are buffered and appended to an O_APPEND
+    # file in large writes; a sidecar index (<log>.idx) holds the byte offset of every record as uint64, and is
+    # written after the records it points to, so a reader can memory-map the log without parsing it.
+    def __init__(self, path, transport, bufferSize=1<<16, flushInterval=0.5):
+        self.path = path
+        self.transport = TRANSPORTS[transport]
+        self.bufferSize = bufferSize
+        self.flushInterval = flushInterval
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0)
+        self.fd = os.open(path, flags, 0o644)
+        self.indexFd = os.open(path+'.idx', flags, 0o644)
+        self.offset = os.fstat(self.fd).st_size
+        self.pending = bytearray()
+        self.pendingIndex = bytearray()
+        self.lastFlush = time.monotonic()
+        self.records = 0
+        atexit.register(self.close)
+
+    def append(self, packets, ts):
+        # packets is a structured array of whole packets (GenericReceiverClass.packetDtype), all from this sensor
+        count = len(packets)
+        length = packets.dtype.itemsize
+        records = np.empty(count, dtype=recordDtype(length))
+        header = records['header']
+        header['ts'] = ts
+        header['transport'] = self.transport
+        header['sendId'] = packets['sendId']
+        header['length'] = length
+        records['packet'] = np.ascontiguousarray(packets).view(np.dtype(('V', length)))
+        self.pending += records.tobytes()
+        self.pendingIndex += (self.offset+np.arange(count, dtype='<u8')*records.itemsize).tobytes()
+        self.offset += count*records.itemsize
+        self.records += count
+        if len(self.pending) >= self.bufferSize or time.monotonic()-self.lastFlush >= self.flushInterval:
+            self.flush()
+
+    def flush(self):
+        for fd, data in ((self.fd, self.pending), (self.indexFd, self.pendingIndex)):
+            with memoryview(data) as view:
+                written = 0
+                while written < len(view):
+                    written += os.write(fd, view[written:])
+        self.pending.clear()
+        self.pendingIndex.clear()
+        self.lastFlush = time.monotonic()
+
+    def close(self):
+        if self.fd is None:
+            return
+        self.flush()
+        os.close(self.fd)
+        os.close(self.indexFd)
+        self.fd = self.indexFd = None
+        atexit.unregister(self.close)
+
+
+def readPacketLog(path):
+    # Returns the records of a log as a structured array with 'header' and 'packet' fields. When every record has
+    # the same length (one receiver writes one packet size), the array is a read-only memory map of the log.
+    offsets = np.fromfile(path+'.idx', dtype='<u8')
+    if len(offsets) == 0:
+        return np.empty(0, dtype=recordDtype(0))
+    log = np.memmap(path, dtype=np.uint8, mode='r')
+    length = int(np.frombuffer(log, RECORD_HEADER, 1, int(offsets[0]))['length'][0])
+    dtype = recordDtype(length)
+    if offsets[0] == 0 and np.all(offsets == np.arange(len(offsets), dtype='<u8')*dtype.itemsize):
+        return np.memmap(path, dtype=dtype, mode='r', shape=(len(offsets),))
+    records = []
+    for offset in offsets.tolist():
+        header = np.frombuffer(log, RECORD_HEADER, 1, offset)
+        records.append(np.frombuffer(log, recordDtype(int(header['length'][0])), 1, offset))
+    length = max(record.dtype['packet'].itemsize for record in records)
+    result = np.zeros(len(records), dtype=recordDtype(length))
+    for i, record in enumerate(records):
+        result[i]['header'] = record['header'][0]
+        result[i]['packet'] = record['packet'][0].tobytes().ljust(length, b'\0')
+    return result
+
+
+def convertPacketLog(configPath, logPath, outPath=None):
+    # Re-runs frame assembly over a packet log and writes the same HDF5 layout that live recording produces
+    from TouchSensorWireless import readConfigFile, buildSensor
+    records = readPacketLog(logPath)
+    if len(records) == 0:
+        return None
+    config = readConfigFile(configPath)
+    sendId = int(records['header']['sendId'][0])
+    sensorConfig = next(sensorConfig for sensorConfig in config['sensors'] if sensorConfig['id'] == sendId)
+    # Offline conversion must not lose frames, so the recorder waits for the writer instead of dropping
+    recordingOptions = {key: value for key, value in config.get('recordingOptions', {}).items() if key != 'backend'}
+    config = {**config, 'recordingOptions': {**recordingOptions, 'backend': "hdf5", 'dropWhenFull': False}}
+    sensor = buildSensor(sensorConfig, config)
+    sensor.path = outPath if outPath is not None else os.path.splitext(logPath)[0]+'.hdf5'
+
+    length = records.dtype['packet'].itemsize
+    numNodes = (length-1-4)//2-1
+    packetDtype = np.dtype([('sendId', np.int8), ('startIdx', '<u2'), ('readings', '<u2', (numNodes,)), ('packet', '<u4')])
+    packets = np.ascontiguousarray(records['packet']).view(packetDtype)
+    readings = packets['readings']
+    header = records['header']
+    # Packets are routed as the live receiver of their transport routed them: wifi-udp fills packet gaps through the
+    # intermittent prediction path even for sensors that are not intermittent (WifiUdpReceiver.handleDatagram)
+    gapFilled = (header['transport'] == TRANSPORTS['wifi-udp']).tolist()
+    for i, (ts, startIdx, packet) in enumerate(zip(header['ts'].tolist(), packets['startIdx'].tolist(), packets['packet'].tolist())):
+        if sensor.intermittent or (gapFilled[i] and startIdx != 20000):
+            sensor.processRowIntermittent(startIdx, readings[i], packet, ts=ts)
+        elif startIdx == 20000:
+            sensor.processRowReadNode(readings[i], packet, ts=ts)
+        else:
+            sensor.processRow(startIdx, readings[i], packet, ts=ts)
+    sensor.closeRecording()
+    return sensor.path
+
+def convertPacketLogs(configPath, logPaths, processes=None):
+    # Logs are per sensor, so they are converted in parallel
+    if not logPaths:
+        return []
+    with multiprocessing.Pool(processes or min(len(logPaths), os.cpu_count())) as pool:
+        return pool.starmap(convertPacketLog, [(configPath, logPath) for logPath in logPaths])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("usage: python PacketLog.py <config.json> <log.wrlog> [<log.wrlog> ...]")
+    for path in convertPacketLogs(sys.argv[1], sys.argv[2:]):
+        print(f"Wrote {path}")
@@ -0,0 +1,296 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import h5py
+import numpy as np
+
+def compressionOptions(compression):
+    # Dataset keyword arguments for a compression name: None, "lzf", "gzip" or "gzip-<level>", or "blosc-lz4"
+    # (the last one needs the hdf5plugin package)
+    if compression is None:
+        return {}
+    if compression == "lzf":
+        return {'compression': "lzf"}
+    if compression == "gzip" or compression.startswith("gzip-"):
+        level = int(compression[5:]) if compression.startswith("gzip-") else 4
+        return {'compression': "gzip", 'compression_opts': level}
+    if compression == "blosc-lz4":
+        try:
+            import hdf5plugin
+        except ImportError:
+            raise ValueError("blosc-lz4 compression requires the hdf5plugin package")
+        return dict(hdf5plugin.Blosc(cname='lz4', clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    raise ValueError(f"Unknown compression '{compression}'")
+
+class Recorder():
+    # Writes one sensor's frames to its HDF5 file from a dedicated writer thread. The ingest side only copies the frame
+    # into a bounded queue; the writer gathers frames into blocks of blockFrames, writes each block with one slice
+    # assignment per dataset and flushes after every block, or after flushInterval seconds if the block is not full.
+    # When the queue is full, new frames are dropped and counted instead of stalling ingest.
+    # Pressure is stored as dtype (values are clipped to its range), in chunks of chunkFrames whole frames
+    # (None lets h5py choose) and optionally compressed.
+    # With swmr, the file is in HDF5 single-writer/multiple-reader mode so other processes can read it while recording
+    # (utils.TactileTail); frame_count is only advanced after the rows it covers have been flushed.
+    # With segmentFrames and/or segmentSeconds, the recording rotates to a new file {name}_0000.hdf5, {name}_0001.hdf5, ...
+    # whenever a segment reaches that many frames or spans that many seconds of frame timestamps. {name}.json lists
+    # every segment with its first frame, frame count and time range; readers in utils accept it in place of a file.
+    # tsIndex holds the timestamp of every indexStride-th frame, a coarse index readers keep in memory for seeking.
+    # If writing fails, the error is reported once and latched: later frames are counted as dropped so ingest keeps
+    # running, stats reports the error and close raises RuntimeError from it.
+    def __init__(self, path, selWires, readWires, maxPackets, queueSize=1024, blockFrames=256, flushInterval=1.0, growFrames=4096,
+                 dtype="int32", chunkFrames=None, compression=None, dropWhenFull=True, swmr=True, segmentFrames=None, segmentSeconds=None, indexStride=1024):
+        self.path = path
+        self.selWires = selWires
+        self.readWires = readWires
+        self.maxPackets = maxPackets
+        self.blockFrames = blockFrames
+        self.flushInterval = flushInterval
+        self.growFrames = max(growFrames, blockFrames)
+        self.dtype = np.dtype(dtype)
+        self.range = np.iinfo(self.dtype)
+        self.chunkFrames = chunkFrames
+        self.compression = compressionOptions(compression)
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.dropWhenFull = dropWhenFull
+        self.swmr = swmr
+        self.segmentFrames = segmentFrames
+        self.segmentSeconds = segmentSeconds
+        self.segmented = bool(segmentFrames or segmentSeconds)
+        self.manifestPath = os.path.splitext(path)[0]+'.json'
+        self.segments = []
+        self.segmentRows = 0 # frames in the current file
+        self.indexStride = indexStride
+        self.file = None
+        self.withPackets = None
+        self.framesWritten = 0
+        self.framesDropped = 0
+        self.blocksWritten = 0
+        self.bytesWritten = 0
+        self.writeTime = 0.0
+        self.lastWrite = time.monotonic()
+        self.error = None
+        self.closed = False
+
+        # Staging block, reused for every write
+        self.staged = 0
+        self.stagedTs = np.zeros(blockFrames)
+        self.stagedPredCount = np.zeros(blockFrames)
+        self.stagedPressure = np.zeros((blockFrames, selWires*readWires), dtype=self.dtype)
+        self.stagedPackets = np.zeros((blockFrames, maxPackets), dtype=np.uint32)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, ts, frame, predCount, packets=None):
+        # Queues a single frame; the frame is copied because the caller reuses its buffer
+        self.put(np.array([ts]), frame.reshape(1, -1).copy(), np.array([predCount]),
+                 None if packets is None else np.array(packets).reshape(1, -1))
+
+    def submitBlock(self, timestamps, frames, predCounts, packets=None):
+        self.put(np.asarray(timestamps), np.array(frames).reshape(len(frames), -1), np.asarray(predCounts),
+                 None if packets is None else np.array(packets))
+
+    def checkError(self):
+        if self.error is not None:
+            raise RuntimeError(f"Recording to {self.path} failed: {self.error}") from self.error
+
+    def put(self, timestamps, frames, predCounts, packets):
+        if self.error is not None:
+            self.framesDropped += len(frames)
+            return
+        if not self.dropWhenFull:
+            self.queue.put((timestamps, frames, predCounts, packets))
+            return
+        try:
+            self.queue.put_nowait((timestamps, frames, predCounts, packets))
+        except queue.Full:
+            self.framesDropped += len(frames)
+
+    def run(self):
+        try:
+            self.write()
+        except Exception as e:
+            self.error = e
+            print(f"Recording to {self.path} failed, further frames are dropped: {e}")
+            if self.file is not None:
+                try:
+                    self.file.close()
+                except Exception:
+                    pass
+                self.file = None
+            # Staged and queued frames are discarded and counted, so a blocked put returns
+            self.framesDropped += self.staged
+            self.staged = 0
+            item = self.queue.get()
+            while item is not None:
+                self.framesDropped += len(item[1])
+                item = self.queue.get()
+
+    def write(self):
+        while True:
+            timeout = max(0.0, self.flushInterval-(time.monotonic()-self.lastWrite))
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                self.stage(*item)
+            if time.monotonic()-self.lastWrite >= self.flushInterval:
+                self.writeBlock()
+        self.writeBlock()
+        if self.file is not None:
+            self.closeSegment()
+
+    def stage(self, timestamps, frames, predCounts, packets):
+        if self.withPackets is None:
+            self.withPackets = packets is not None
+        start = 0
+        while start < len(frames):
+            count = min(len(frames)-start, self.blockFrames-self.staged)
+            rows = slice(self.staged, self.staged+count)
+            self.stagedTs[rows] = timestamps[start:start+count]
+            self.stagedPredCount[rows] = predCounts[start:start+count]
+            np.clip(frames[start:start+count], self.range.min, self.range.max, out=self.stagedPressure[rows], casting='unsafe')
+            if packets is not None:
+                self.stagedPackets[rows] = packets[start:start+count]
+            else:
+                self.stagedPackets[rows] = 0
+            self.staged += count
+            start += count
+            if self.staged == self.blockFrames:
+                self.writeBlock()
+
+    def openFile(self, firstTs):
+        path = self.path
+        if self.segmented:
+            base, extension = os.path.splitext(self.path)
+            path = f"{base}_{len(self.segments):04d}{extension}"
+        self.file = h5py.File(path, 'w', libver='latest') if self.swmr else h5py.File(path, 'w')
+        self.segmentRows = 0
+        f = self.file
+        growFrames = self.growFrames
+        chunkFrames = self.chunkFrames
+        options = self.compression
+        f.create_dataset('frame_count', (1,), maxshape=(None,), dtype=np.uint32)
+        f.create_dataset('ts', (growFrames,), maxshape=(None,), dtype=np.float64, chunks=(chunkFrames,) if chunkFrames else True, **options)
+        f.create_dataset('predCount', (growFrames,), maxshape=(None,), dtype=np.float64, chunks=(chunkFrames,) if chunkFrames else True, **options)
+        f.create_dataset('pressure', (growFrames, self.selWires, self.readWires), maxshape=(None, self.selWires, self.readWires), dtype=self.dtype,
+                         chunks=(chunkFrames, self.selWires, self.readWires) if chunkFrames else True, **options)
+        if self.withPackets:
+            f.create_dataset('packetNumber', (growFrames, self.maxPackets), maxshape=(None, self.maxPackets), dtype=np.uint32,
+                             chunks=(chunkFrames, self.maxPackets) if chunkFrames else True, **options)
+        f.create_dataset('tsIndex', (0,), maxshape=(None,), dtype=np.float64, chunks=(1024,))
+        f['tsIndex'].attrs['stride'] = self.indexStride
+        # No datasets can be added once SWMR writing starts
+        if self.swmr:
+            f.swmr_mode = True
+        if self.segmented:
+            # A segment is only listed once it can be opened by readers
+            self.segments.append({'path': os.path.basename(path), 'firstFrame': self.framesWritten, 'frames': None,
+                                  'startTs': float(firstTs), 'endTs': None})
+            self.writeManifest()
+
+    def closeSegment(self):
+        self.file.close()
+        self.file = None
+        if self.segmented:
+            segment = self.segments[-1]
+            segment['frames'] = self.segmentRows
+            segment['endTs'] = self.segmentEndTs
+            self.writeManifest()
+
+    def writeManifest(self):
+        # Replaced atomically so readers never see a partial manifest
+        tmpPath = self.manifestPath+'.tmp'
+        with open(tmpPath, 'w') as file:
+            json.dump({'segments': self.segments}, file, indent=2)
+        os.replace(tmpPath, self.manifestPath)
+
+    def writeBlock(self):
+        # Also restarts the flushInterval timer, so a block written because it was full is not followed by an early flush
+        self.lastWrite = time.monotonic()
+        count = self.staged
+        if count == 0:
+            return
+        start = time.perf_counter()
+        written = 0
+        while written < count:
+            if self.file is None:
+                self.openFile(self.stagedTs[written])
+            rows = count-written
+            if self.segmentFrames:
+                rows = min(rows, self.segmentFrames-self.segmentRows)
+            if self.segmentSeconds:
+                limit = self.segments[-1]['startTs']+self.segmentSeconds
+                rows = min(rows, int(np.searchsorted(self.stagedTs[written:written+rows], limit)))
+            if rows == 0:
+                # The first staged frame belongs to the next segment
+                self.closeSegment()
+                continue
+            self.writeRows(written, written+rows)
+            written += rows
+            if self.segmentFrames and self.segmentRows == self.segmentFrames:
+                self.closeSegment()
+        self.staged = 0
+        self.blocksWritten += 1
+        self.bytesWritten += count*(16+self.stagedPressure.itemsize*self.stagedPressure.shape[1]+(4*self.maxPackets if self.withPackets else 0))
+        self.writeTime += time.perf_counter()-start
+
+    def writeRows(self, start, stop):
+        # Writes staged rows start..stop-1 to the end of the current file
+        f = self.file
+        count = stop-start
+        first = self.segmentRows
+        end = first+count
+        if f['ts'].shape[0] < end:
+            newSize = -(-end//self.growFrames)*self.growFrames
+            for key in ('ts', 'predCount', 'pressure', 'packetNumber'):
+                if key in f:
+                    f[key].resize(newSize, axis=0)
+        f['ts'][first:end] = self.stagedTs[start:stop]
+        f['predCount'][first:end] = self.stagedPredCount[start:stop]
+        f['pressure'][first:end] = self.stagedPressure[start:stop].reshape(count, self.selWires, self.readWires)
+        if self.withPackets:
+            f['packetNumber'][first:end] = self.stagedPackets[start:stop]
+        stride = self.indexStride
+        indexed = -(-first//stride)
+        if indexed*stride < end:
+            entries = self.stagedTs[start+indexed*stride-first:stop:stride]
+            f['tsIndex'].resize(indexed+len(entries), axis=0)
+            f['tsIndex'][indexed:] = entries
+        # frame_count is the number of frames in the file; it is written and flushed last so readers never see unwritten rows
+        f.flush()
+        f['frame_count'][0] = end
+        f['frame_count'].flush()
+        self.segmentRows = end
+        self.segmentEndTs = float(self.stagedTs[stop-1])
+        self.framesWritten += count
+
+    def stats(self):
+        return {
+            'queueDepth': self.queue.qsize(),
+            'framesWritten': self.framesWritten,
+            'framesDropped': self.framesDropped,
+            'blocksWritten': self.blocksWritten,
+            'framesPerSecond': self.framesWritten/self.writeTime if self.writeTime > 0 else 0.0,
+            'megabytesPerSecond': self.bytesWritten/self.writeTime/1e6 if self.writeTime > 0 else 0.0,
+            'error': None if self.error is None else str(self.error),
+        }
+
+    def close(self):
+        # Writes everything still queued and closes the file
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        atexit.unregister(self.close)
+        self.checkError()
+        stats = self.stats()
+        print(f"Recorded {stats['framesWritten']} frames to {self.manifestPath if self.segmented else self.path} ({stats['framesDropped']} dropped, {stats['framesPerSecond']:.0f} frames/s while writing)")
@@ -0,0 +1,151 @@
+import json
+import os
+import h5py
+import numpy as np
+
+def recordingSegments(path):
+    # Segments of a recording as (path, first frame, frames or None while still being written). A plain HDF5 file is
+    # a single segment; a segmented recording is given by its manifest (.json).
+    if not path.endswith('.json'):
+        return [(path, 0, None)]
+    with open(path, 'r') as file:
+        manifest = json.load(file)
+    directory = os.path.dirname(path)
+    return [(os.path.join(directory, segment['path']), segment['firstFrame'], segment['frames']) for segment in manifest['segments']]
+
+class RecordingReader():
+    # Lazy reader for a recording (HDF5 file or segment manifest). Nothing is read until a window is requested, and
+    # then only the frames in that window are read, chunkFrames at a time, cast to dtype chunk by chunk.
+    # Seeks by timestamp use a two-level index: the timestamp of every indexStride-th frame stays in memory (read from
+    # the recording's tsIndex, or built once from ts for older files), and only one stride of ts is read per seek.
+    def __init__(self, path, dtype=np.float32, chunkFrames=1024, indexStride=1024):
+        self.path = path
+        self.dtype = dtype
+        self.chunkFrames = chunkFrames
+        self.files = {}
+        self.segments = []
+        for segmentPath, firstFrame, frames in recordingSegments(path):
+            if frames is None:
+                frames = int(self.file(segmentPath)['frame_count'][0])
+            self.segments.append((segmentPath, firstFrame, frames))
+        self.frameCount = sum(frames for segmentPath, firstFrame, frames in self.segments)
+        self.timestamps = None
+        self.indexStride = indexStride
+        self.indexTs = None
+        self.indexFrames = None
+
+    def __len__(self):
+        return self.frameCount
+
+    def file(self, segmentPath):
+        if segmentPath not in self.files:
+            self.files[segmentPath] = h5py.File(segmentPath, 'r', swmr=True)
+        return self.files[segmentPath]
+
+    @property
+    def shape(self):
+        return self.dataset(self.segments[0][0], 'pressure').shape[1:]
+
+    def dataset(self, segmentPath, key):
+        return self.file(segmentPath)[key]
+
+    def ts(self):
+        # Timestamps of every frame; they are small next to the pressure data and are loaded once
+        if self.timestamps is None:
+            timestamps = [self.dataset(segmentPath, 'ts')[:frames] for segmentPath, firstFrame, frames in self.segments]
+            self.timestamps = np.concatenate(timestamps) if timestamps else np.empty(0)
+        return self.timestamps
+
+    def buildIndex(self):
+        indexTs = []
+        indexFrames = []
+        for segmentPath, firstFrame, frames in self.segments:
+            file = self.file(segmentPath)
+            if 'tsIndex' in file:
+                stride = int(file['tsIndex'].attrs['stride'])
+                entries = file['tsIndex'][:-(-frames//stride)]
+            else:
+                stride = self.indexStride
+                entries = np.concatenate([chunk['ts'][::stride] for first, chunk in
+                                          self.chunks(firstFrame, firstFrame+frames, chunkFrames=stride*64, keys=('ts',))] or [np.empty(0)])
+            indexTs.append(entries)
+            indexFrames.append(firstFrame+np.arange(len(entries))*stride)
+        self.indexTs = np.concatenate(indexTs) if indexTs else np.empty(0)
+        self.indexFrames = np.concatenate(indexFrames) if indexFrames else np.empty(0, dtype=np.int64)
+
+    def seek(self, value, side='left'):
+        # Index of the first frame with ts >= value (side='left') or > value (side='right'), by binary search
+        if self.indexTs is None:
+            self.buildIndex()
+        block = int(np.searchsorted(self.indexTs, value, side))-1
+        if block < 0:
+            return 0
+        start = int(self.indexFrames[block])
+        stop = int(self.indexFrames[block+1]) if block+1 < len(self.indexFrames) else self.frameCount
+        return start+int(np.searchsorted(self.readTs(start, stop), value, side))
+
+    def readTs(self, start, stop):
+        blocks = [chunk['ts'] for first, chunk in self.chunks(start, stop, keys=('ts',))]
+        return np.concatenate(blocks) if blocks else np.empty(0)
+
+    def tsAt(self, frame):
+        return float(self.readTs(frame, frame+1)[0])
+
+    def closestFrame(self, value):
+        # (frame, ts) of the frame recorded closest to value
+        frame = self.seek(value)
+        candidates = self.readTs(max(frame-1, 0), min(frame+1, self.frameCount))
+        best = int(np.abs(candidates-value).argmin())
+        return max(frame-1, 0)+best, float(candidates[best])
+
+    def frameWindow(self, startTs=None, endTs=None):
+        # Frames [start, stop) recorded between startTs and endTs
+        start = 0 if startTs is None else self.seek(startTs, 'left')
+        stop = self.frameCount if endTs is None else self.seek(endTs, 'right')
+        return start, stop
+
+    def chunks(self, start=0, stop=None, chunkFrames=None, dtype=None, keys=('pressure', 'ts')):
+        # Yields (first frame, {key: array}) for frames [start, stop), never crossing a segment boundary
+        stop = self.frameCount if stop is None else min(stop, self.frameCount)
+        chunkFrames = chunkFrames or self.chunkFrames
+        dtype = dtype or self.dtype
+        for segmentPath, firstFrame, frames in self.segments:
+            segmentStart = max(start, firstFrame)
+            segmentStop = min(stop, firstFrame+frames)
+            for chunkStart in range(segmentStart, segmentStop, chunkFrames):
+                chunkStop = min(chunkStart+chunkFrames, segmentStop)
+                chunk = {}
+                for key in keys:
+                    data = self.dataset(segmentPath, key)[chunkStart-firstFrame:chunkStop-firstFrame]
+                    chunk[key] = data.astype(dtype) if key == 'pressure' else np.asarray(data)
+                yield chunkStart, chunk
+
+    def iterFrames(self, start=0, stop=None, chunkFrames=None, dtype=None):
+        # Yields (pressure, ts, first frame) blocks of at most chunkFrames frames
+        for first, chunk in self.chunks(start, stop, chunkFrames, dtype):
+            yield chunk['pressure'], chunk['ts'], first
+
+    def iterWindow(self, startTs=None, endTs=None, chunkFrames=None, dtype=None):
+        start, stop = self.frameWindow(startTs, endTs)
+        return self.iterFrames(start, stop, chunkFrames, dtype)
+
+    def read(self, start=0, stop=None, dtype=None):
+        # Frames [start, stop) as one (pressure, ts) pair
+        stop = self.frameCount if stop is None else min(stop, self.frameCount)
+        pressure = np.empty((max(stop-start, 0),)+self.shape, dtype=dtype or self.dtype)
+        ts = np.empty(max(stop-start, 0))
+        for chunkPressure, chunkTs, first in self.iterFrames(start, stop, dtype=dtype):
+            pressure[first-start:first-start+len(chunkTs)] = chunkPressure
+            ts[first-start:first-start+len(chunkTs)] = chunkTs
+        return pressure, ts
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
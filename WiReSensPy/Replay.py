@@ -0,0 +1,35 @@
+import heapq
+import time
+from operator import itemgetter
+
+def sensorFrames(sensorId, reader, start=0, stop=None, chunkFrames=None):
+    # Streams (ts, sensorId, frame) for frames [start, stop) of one recording, reading chunkFrames at a time
+    for pressure, ts, first in reader.iterFrames(start, stop, chunkFrames):
+        for i, frameTs in enumerate(ts.tolist()):
+            yield frameTs, sensorId, pressure[i]
+
+def mergeByTimestamp(streams):
+    # k-way merge of per-sensor streams into one stream ordered by recorded timestamp
+    return heapq.merge(*streams, key=itemgetter(0))
+
+def pace(frames, speed=1, clock=time.monotonic, sleep=time.sleep):
+    # Groups a timestamp-ordered stream into batches of frames that are due, waiting until each batch's recorded time
+    # (scaled by speed) has come. Deadlines are measured from the start of playback rather than from the previous
+    # frame, so time spent emitting or oversleeping is absorbed instead of accumulating as drift. When playback falls
+    # behind, every overdue frame goes into the next batch.
+    batch = []
+    start = firstTs = None
+    for item in frames:
+        if start is None:
+            start, firstTs = clock(), item[0]
+        due = start+(item[0]-firstTs)/speed
+        if due > clock():
+            if batch:
+                yield batch
+                batch = []
+            delay = due-clock()
+            if delay > 0:
+                sleep(delay)
+        batch.append(item)
+    if batch:
+        yield batch
@@ -0,0 +1,135 @@
+import binascii
+import struct
+
+# Length-prefixed frame: sync word, uint16 little-endian payload length, payload, optional CRC-16/CCITT of length+payload
+SYNC_WORD = b'\xa5\x5a'
+CRC_INIT = 0xFFFF
+
+class RingBuffer():
+    # Preallocated receive buffer. Transports fill the free tail in place (recv_into/readinto/BufferedProtocol)
+    # and whole packets are handed out as memoryview slices, so steady-state ingest copies no packet bytes.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.start = 0 # first unread byte
+        self.end = 0 # one past the last written byte
+        self.scanned = 0 # delimiter search resumes here so bytes are never rescanned
+        self.overflows = 0
+        self.frames = 0
+        self.dropped = 0 # frames rejected by length or checksum
+        self.resyncs = 0 # times garbage was skipped to find the next sync word
+
+    def __len__(self):
+        return self.end - self.start
+
+    def compact(self):
+        # Moves the unread bytes (less than one packet in steady state) to the front of the buffer
+        size = self.end - self.start
+        if self.start > 0:
+            self.view[:size] = self.view[self.start:self.end]
+            self.scanned -= self.start
+            self.start = 0
+            self.end = size
+        if self.end == self.capacity:
+            # No frame boundary in a full buffer: drop it rather than grow
+            self.overflows += 1
+            self.dropped += 1
+            self.start = self.end = self.scanned = 0
+
+    def writable(self):
+        if self.end == self.capacity:
+            self.compact()
+        return self.view[self.end:]
+
+    def advance(self, nbytes):
+        self.end += nbytes
+
+    def recvInto(self, sock):
+        nbytes = sock.recv_into(self.writable())
+        self.advance(nbytes)
+        return nbytes
+
+    def readInto(self, stream):
+        nbytes = stream.readinto(self.writable())
+        if nbytes:
+            self.advance(nbytes)
+        return nbytes
+
+    def write(self, data):
+        data = memoryview(data)
+        while len(data) > 0:
+            target = self.writable()
+            nbytes = min(len(target), len(data))
+            target[:nbytes] = data[:nbytes]
+            self.advance(nbytes)
+            data = data[nbytes:]
+
+    def fixedPackets(self, packetSize):
+        while self.end - self.start >= packetSize:
+            packet = self.view[self.start:self.start+packetSize]
+            self.start += packetSize
+            yield packet
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
+
+    def fixedBlock(self, packetSize):
+        # All complete packets currently buffered, as one contiguous slice
+        size = (self.end - self.start)//packetSize*packetSize
+        block = self.view[self.start:self.start+size]
+        self.start += size
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
+        return block
+
+    def delimitedPackets(self, delimiter):
+        self.scanned = max(self.scanned, self.start)
+        while True:
+            idx = self.buffer.find(delimiter, self.scanned, self.end)
+            if idx < 0:
+                self.scanned = max(self.start, self.end-len(delimiter)+1)
+                break
+            packet = self.view[self.start:idx]
+            self.start = self.scanned = idx+len(delimiter)
+            self.frames += 1
+            yield packet
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
+
+    def lengthPrefixedPackets(self, maxLength, checksum=False, sync=SYNC_WORD):
+        # Each byte is skipped at most once while hunting for a sync word, so parsing stays linear under bursty input
+        headerSize = len(sync)+2
+        trailerSize = 2 if checksum else 0
+        buffer = self.buffer
+        while self.end - self.start >= headerSize:
+            idx = buffer.find(sync, self.start, self.end)
+            if idx != self.start:
+                self.resyncs += 1
+                if idx < 0:
+                    # Keep a possible partial sync word at the end
+                    self.start = self.end-len(sync)+1
+                    break
+                self.start = idx
+                continue
+            if self.end - self.start < headerSize:
+                break
+            length = struct.unpack_from('<H', buffer, self.start+len(sync))[0]
+            if length > maxLength:
+                self.dropped += 1
+                self.start += 1
+                continue
+            frameSize = headerSize+length+trailerSize
+            if self.end - self.start < frameSize:
+                break
+            if checksum:
+                crc = struct.unpack_from('<H', buffer, self.start+headerSize+length)[0]
+                if binascii.crc_hqx(self.view[self.start+len(sync):self.start+headerSize+length], CRC_INIT) != crc:
+                    self.dropped += 1
+                    self.start += 1
+                    continue
+            packet = self.view[self.start+headerSize:self.start+headerSize+length]
+            self.start += frameSize
+            self.frames += 1
+            yield packet
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
@@ -1,25 +1,41 @@
 import numpy as np
-import h5py
 import time
 import asyncio
 import utils
+from FrameHistory import FrameHistory
+from Recorder import Recorder
 
 class Sensor():
-    def __init__(self, selWires:int, readWires:int,numNodes, id, deviceName = "Esp1", intermittent = False, p=15, fileName=None):
+    def __init__(self, selWires:int, readWires:int,numNodes, id, deviceName = "Esp1", intermittent = False, p=15, fileName=None, frameBuffers=3, historySize=64, recordingOptions=None):
         self.id = id
         self.readWires = readWires
         self.selWires = selWires
         self.deviceName = deviceName
         self.path = f'./{fileName}.hdf5' if fileName is not None else f'./recordings/recordings_{id}_{str(time.time())}.hdf5'
-        self.file = None
-        self.pressure = np.zeros(readWires*selWires)
+        # Frames are recorded by a background Recorder, created on the first recorded frame
+        self.recorder = None
+        self.recordingOptions = dict(recordingOptions or {})
+        # With the packetlog backend the receiver logs raw packets and no frames are written here
+        self.logPackets = self.recordingOptions.pop('backend', "hdf5") == "packetlog"
+        # Frames are assembled in a back buffer and published by swapping, so readers never see a half-written frame.
+        # A published frame stays untouched until frameBuffers-1 newer frames have been published.
+        self.frameBuffers = frameBuffers
+        self.frames = np.zeros((frameBuffers, readWires*selWires))
+        self.frameViews = [frame.view() for frame in self.frames]
+        for frameView in self.frameViews:
+            frameView.flags.writeable = False
+        self.backIdx = 1
+        self.assembly = self.frames[self.backIdx]
+        self.published = (self.frameViews[0], 0, None) # (frame, frame count, timestamp), replaced atomically
+        # Last historySize frames for consumers that need temporal context
+        self.history = FrameHistory(historySize, selWires, readWires)
+        self.framePredicted = False
         self.fc = 0
         self.init = False
         self.filledSize = 0
         self.bufferSize = numNodes
         self.pressureLength = readWires*selWires
         self.left_to_fill = self.pressureLength
-        self.block_size=1024
         self.packetCount = 0
         self.maxPackets = int(np.ceil(self.pressureLength/self.bufferSize))
         self.receivedPackets = np.zeros(self.maxPackets)
@@ -28,64 +44,91 @@ class Sensor():
         #intermittent 
         self.intermittent = intermittent
         self.receivedIdxs = np.zeros(self.maxPackets)
-        self.prevPressure = np.zeros(readWires*selWires)
+        self.prevPressure = np.zeros(readWires*selWires) # frame before the last complete one
+        self.prevFrame = self.prevPressure # owned copy of it, only needed with two frame buffers
         self.intermittentInit = False
         self.expectedPacket = 1
         self.nextStartIdx = 0
         self.p=p
         self.predCount=0
         self.lastTs = None
+        self.maxGapPackets = 64*self.maxPackets # long gaps are predicted in batches of this many packets to bound memory
 
+        #shared memory publication of completed frames (sharded ingest)
+        self.sharedFrame = None
+
+
+    def getRecorder(self):
+        if self.recorder is None:
+            self.recorder = Recorder(self.path, self.selWires, self.readWires, self.maxPackets, **self.recordingOptions)
+            self.init = True
+        return self.recorder
 
     def append_data(self, ts,reading, packet):
-        f = self.file
-        block_size = self.block_size
-        fc = self.fc
-        init = self.init
-        if not init:
-            self.file = h5py.File(self.path, 'w')
-            f=self.file
-            self.init=True
-            sz = [block_size, ]
-            maxShape = sz.copy()
-            maxShape[0] = None
-            maxshapePressure = [None,self.selWires,self.readWires]
-            f.create_dataset('frame_count', (1,),maxshape=maxShape, dtype=np.uint32)
-            f.create_dataset('ts', tuple([block_size, ]), maxshape = maxShape, dtype=ts.dtype, chunks=True)
-            f.create_dataset('predCount', tuple([block_size, ]), maxshape = maxShape, dtype=ts.dtype, chunks=True)
-            f.create_dataset('pressure', tuple([block_size, self.selWires,self.readWires]), maxshape=maxshapePressure, dtype=np.int32, chunks=True)
-            if packet is not None:
-                maxshapePackets = [None, self.maxPackets]
-                f.create_dataset('packetNumber', tuple([block_size, self.maxPackets]), maxshape=maxshapePackets, dtype=np.uint32, chunks=True)
-
-        # Check size
-        oldSize = f['ts'].shape[0]
-        if oldSize == fc:
-            newSize = oldSize + block_size
-            f['ts'].resize(newSize, axis=0)
-            f['pressure'].resize(newSize, axis=0)
-            f['predCount'].resize(newSize, axis=0)
-            if packet is not None:
-                f['packetNumber'].resize(newSize, axis=0)
-
-        f['frame_count'][0] = fc
-        f['ts'][fc] = ts
-        f['predCount'][fc] = self.predCount
-        f['pressure'][fc] = reading.reshape(1, self.selWires,self.readWires)
-        if packet is not None:
-            f['packetNumber'][fc] = self.receivedPackets
-        f.flush()
+        # Hands the frame to the background recorder; the HDF5 write happens on its writer thread
+        self.getRecorder().submit(ts, reading, self.predCount, None if packet is None else self.receivedPackets)
+
+    def append_block(self, timestamps, frames, packetNumbers, predCounts):
+        self.getRecorder().submitBlock(timestamps, frames, predCounts, packetNumbers)
+
+    def recordingStats(self):
+        return self.recorder.stats() if self.recorder is not None else None
+
+    def closeRecording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
+    @property
+    def pressure(self):
+        return self.published[0]
+
+    def snapshot(self, copy=False):
+        # Last complete frame and its frame count. Without copy, the frame is the published buffer itself
+        frame, fc, ts = self.published
+        return (frame.copy() if copy else frame), fc
+
+    def latest_frame(self):
+        frame, fc, ts = self.published
+        return frame.reshape(self.selWires, self.readWires), fc, ts
+
+    def framesSince(self, seq, copy=False):
+        # Frames with a frame count greater than seq: (frames, timestamps, predicted flags, frame count of the first one)
+        return self.history.since(seq, copy)
+
+    def completeFrame(self, ts, packet, record):
+        if record and not self.logPackets:
+            self.append_data(ts,self.assembly,packet)
+        self.fc+=1
+        self.history.append(self.assembly, self.fc, ts, self.framePredicted)
+        self.framePredicted = False
+        # The predictor extrapolates from the last two frames, and any sensor can reach it (wifi-udp gap filling goes
+        # through processRowIntermittent). With three or more buffers the previous front is not reused before the next
+        # frame is published, so it is read in place; with two it becomes the next back buffer and must be copied
+        if self.frameBuffers > 2:
+            self.prevPressure = self.published[0]
+        else:
+            np.copyto(self.prevFrame, self.published[0])
+            self.prevPressure = self.prevFrame
+        # Publish the finished back buffer with a single tuple assignment, then continue assembling in the next buffer
+        frontIdx = self.backIdx
+        self.published = (self.frameViews[frontIdx], self.fc, ts)
+        self.backIdx = (frontIdx+1)%self.frameBuffers
+        self.assembly = self.frames[self.backIdx]
+        # Nodes not yet received for the next frame keep their latest values
+        np.copyto(self.assembly, self.frames[frontIdx])
+        if self.sharedFrame is not None:
+            self.sharedFrame.publish(self.pressure, self.fc, ts)
 
     def fillBuffer(self, startIdx, amountToFill, readings):
         if startIdx + amountToFill <= self.pressureLength:
-            self.pressure[startIdx:startIdx+amountToFill] = np.array(readings[:amountToFill])
+            self.assembly[startIdx:startIdx+amountToFill] = readings[:amountToFill]
         else:
             firstSize = self.pressureLength - startIdx
             secondSize = amountToFill- firstSize
-            self.pressure[startIdx:]=np.array(readings[:firstSize])
-            self.pressure[:secondSize]=np.array(readings[firstSize:amountToFill])
+            self.assembly[startIdx:]=readings[:firstSize]
+            self.assembly[:secondSize]=readings[firstSize:amountToFill]
 
-    def processRow(self, startIdx,readings, packet=None, record=True):
+    def processRow(self, startIdx,readings, packet=None, record=True, ts=None):
         if packet is not None:
                 self.receivedPackets[self.packetCount]=packet
                 self.packetCount+=1
@@ -93,10 +136,9 @@ class Sensor():
 
             if self.left_to_fill > 0:
                 self.fillBuffer(startIdx,self.left_to_fill,readings)
-            ts = utils.getUnixTimestamp()
-            if record:
-                self.append_data(ts,self.pressure,packet)
-            self.fc+=1
+            if ts is None:
+                ts = utils.getUnixTimestamp()
+            self.completeFrame(ts,packet,record)
             self.packetCount = 0
             self.receivedPackets=np.zeros(self.maxPackets)
             remaining = self.bufferSize - self.left_to_fill
@@ -106,55 +148,45 @@ class Sensor():
             self.fillBuffer(startIdx,self.bufferSize, readings)
             self.left_to_fill -= self.bufferSize
 
-    def processRowReadNode(self,readings,packet,record=True):
-        for i in range(0,len(readings),2):
-            nodeLocation = readings[i]
-            nodeReading = readings[i+1]
-            self.pressure[nodeLocation] = nodeReading
-            if nodeLocation == self.pressureLength-1 and record:
-                ts = utils.getUnixTimestamp()
-                self.append_data(ts,self.pressure,packet)
-                self.fc+=1
+    def processRowReadNode(self,readings,packet,record=True, ts=None):
+        # Readings are (location, reading) pairs; the last node marks the end of a frame, and a packet may span several frames
+        pairs = len(readings)//2
+        locations = readings[0:2*pairs:2]
+        values = readings[1:2*pairs:2]
+        frameEnds = np.flatnonzero(locations == self.pressureLength-1)
+        segmentStart = 0
+        for segmentEnd in frameEnds.tolist():
+            self.assembly[locations[segmentStart:segmentEnd+1]] = values[segmentStart:segmentEnd+1]
+            self.completeFrame(utils.getUnixTimestamp() if ts is None else ts,packet,record)
+            segmentStart = segmentEnd+1
+        if segmentStart < pairs:
+            self.assembly[locations[segmentStart:]] = values[segmentStart:]
 
     
-    def processRowIntermittent(self, startIdx, readings, packet, record=True):
+    def processRowIntermittent(self, startIdx, readings, packet, record=True, ts=None):
          # If the packet id is not what we're expecting (during intermittent sending), then we should predict all of the missed packets in between
-        if packet != self.expectedPacket and self.intermittentInit:
-            currTs = utils.getUnixTimestamp()
-            for packetIdx in range(self.expectedPacket, packet):
-                #Predict Packet
-                predicted = self.predictPacket(self.nextStartIdx)
-                #Estimate Timestamp
-                predTs = self.lastTs + ((currTs-self.lastTs)*(packetIdx-self.expectedPacket)/(packet-self.expectedPacket))
-                self.predCount+=1
-                self.packetHandle(self.nextStartIdx,predicted,packetIdx, predTs, record)
-                self.nextStartIdx = (startIdx+self.bufferSize)%self.pressureLength
-                self.receivedPackets[self.packetCount]=packet
-                self.packetCount+=1
-            self.lastTs = currTs
-        else:
+        if ts is None:
             ts = utils.getUnixTimestamp()
-            self.packetHandle(startIdx,readings,packet, ts, record)
-            self.nextStartIdx = (startIdx+self.bufferSize)%self.pressureLength
-            self.receivedPackets[self.packetCount]=packet
-            self.packetCount+=1
-            self.lastTs = ts
+        if packet > self.expectedPacket and self.intermittentInit:
+            missing = packet-self.expectedPacket
+            # Timestamps of the missing packets are interpolated between the last received packet and this one
+            predTs = self.lastTs + (ts-self.lastTs)*np.arange(1, missing+1)/(missing+1)
+            for first in range(0, missing, self.maxGapPackets):
+                self.predictPackets(predTs[first:first+self.maxGapPackets], record)
+        # The packet that revealed the gap still carries real readings
+        self.receivedPackets[self.packetCount]=packet
+        self.packetCount+=1
+        self.packetHandle(startIdx,readings,packet, ts, record)
+        self.nextStartIdx = (startIdx+self.bufferSize)%self.pressureLength
+        self.lastTs = ts
         self.expectedPacket = packet+1
-        
-            
-
 
-        
     def packetHandle(self,startIdx,readings,packet, ts, record):
-        print(ts)
         if self.left_to_fill <= self.bufferSize:
             if self.left_to_fill > 0:
                 self.fillBuffer(startIdx,self.left_to_fill,readings)
-            if record:
-                self.append_data(ts,self.pressure,packet)
-            self.prevPressure = self.pressure
-            self.fc+=1
-            if self.fc==2:
+            self.completeFrame(ts,packet,record)
+            if self.fc>=2:
                 self.intermittentInit=True
             self.packetCount = 0
             self.receivedPackets=np.zeros(self.maxPackets)
@@ -165,16 +197,68 @@ class Sensor():
             self.fillBuffer(startIdx,self.bufferSize, readings)
             self.left_to_fill -= self.bufferSize
 
-    def predictPacket(self,startIdx):
-        predicted=np.zeros(self.bufferSize)
-        endIdx=min(self.bufferSize, self.pressureLength-startIdx)
-        predicted[:endIdx]=self.pressure[startIdx:startIdx+endIdx] + 1/self.p*(self.pressure[startIdx:startIdx+endIdx]-self.prevPressure[startIdx:startIdx+endIdx])
-        #Handle overflow
-        if startIdx+self.bufferSize>self.pressureLength:
-            newIdx = endIdx
-            endIdx = self.bufferSize-(self.pressureLength-startIdx)
-            predicted[newIdx:] = self.pressure[:endIdx] + 1/self.p*(self.pressure[:endIdx]-self.prevPressure[:endIdx])
-        return predicted
+    def predictPackets(self, timestamps, record):
+        # Predicts len(timestamps) consecutive missing packets starting at nextStartIdx in one step.
+        # Applied packet by packet, the predictor is x[k+1] = x[k] + (x[k]-x[k-1])/p per node, where k counts frames;
+        # its closed form x[k] = x[0] + (x[0]-x[-1])*(1-p^-k)/(p-1) gives every predicted node directly.
+        L = self.pressureLength
+        numPackets = len(timestamps)
+        n = numPackets*self.bufferSize
+        filledCount = L-self.left_to_fill # nodes of the frame being assembled that were already received
+        nodes = np.arange(n)
+        positions = (self.nextStartIdx+nodes)%L
+        frameOfNode = (nodes+filledCount)//L # 0 is the frame being assembled
+        frameStart = (self.nextStartIdx-filledCount)%L
+        received = (positions-frameStart)%L < filledCount
+        # Every node extrapolates from the two frames before its own: nodes already received for the frame being
+        # assembled start from that frame, the others from the last complete frame
+        front = self.pressure
+        base = np.where(received, self.assembly[positions], front[positions])
+        basePrev = np.where(received, front[positions], self.prevPressure[positions])
+        steps = frameOfNode + ~received
+        if self.p == 1:
+            gain = steps
+        else:
+            gain = (1-np.power(float(self.p), -steps))/(self.p-1)
+        predicted = base + (base-basePrev)*gain
+
+        completed = 0 if n < self.left_to_fill else (n-self.left_to_fill)//L+1
+        if completed > 0:
+            frames = np.empty((completed, L))
+            frames[0] = self.assembly
+            inFrame = frameOfNode < completed
+            frames[frameOfNode[inFrame], positions[inFrame]] = predicted[inFrame]
+            # Each frame takes the timestamp of the packet that completes it
+            lastPacket = (self.left_to_fill-1+np.arange(completed)*L)//self.bufferSize
+            packetNumbers = np.zeros((completed, self.maxPackets))
+            packetNumbers[0] = self.receivedPackets
+            self.completeFrames(frames, timestamps[lastPacket], packetNumbers, self.predCount+lastPacket+1, record)
+            self.packetCount = 0
+            self.receivedPackets=np.zeros(self.maxPackets)
+            rest = frameOfNode == completed
+            self.assembly[positions[rest]] = predicted[rest]
+            self.left_to_fill = L-np.count_nonzero(rest)
+            self.framePredicted = self.left_to_fill < L
+        else:
+            self.assembly[positions] = predicted
+            self.left_to_fill -= n
+            self.framePredicted = True
+        self.predCount += numPackets
+        self.nextStartIdx = (self.nextStartIdx+n)%L
+
+    def completeFrames(self, frames, timestamps, packetNumbers, predCounts, record):
+        # Completes several predicted frames at once; they are recorded as one block and only the newest is published
+        count = len(frames)
+        if record and not self.logPackets:
+            self.append_block(timestamps, frames, packetNumbers, predCounts)
+        for i in range(count-1):
+            self.history.append(frames[i], self.fc+i+1, timestamps[i], True)
+        self.fc += count-1
+        np.copyto(self.assembly, frames[-1])
+        self.framePredicted = True
+        self.completeFrame(timestamps[-1], None, False)
+        if count > 1:
+            self.prevPressure = frames[-2]
 
     async def processRowAsync(self, startIdx,readings, packet=None):
         async with self.lock:
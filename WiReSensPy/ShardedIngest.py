@@ -0,0 +1,109 @@
+import numpy as np
+from FrameHistory import FrameHistory
+from multiprocessing import shared_memory
+
+class SharedFrame():
+    # Shared memory block holding a sensor's latest complete frame and its frame history:
+    # [sequence, frame count][timestamp][frame][FrameHistory]
+    # The sequence is a seqlock: it is odd while the worker is writing a frame
+    READ_RETRIES = 10000
+
+    def __init__(self, length, dtype=np.float64, name=None, historyShape=(0, 0, 0)):
+        self.owner = name is None
+        itemsize = np.dtype(dtype).itemsize
+        self.historyOffset = 24+(length*itemsize+7)//8*8
+        self.historyShape = historyShape
+        size = self.historyOffset+FrameHistory.nbytes(*historyShape)
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.name = self.shm.name
+        self.counters = np.ndarray((2,), dtype=np.int64, buffer=self.shm.buf, offset=0)
+        self.ts = np.ndarray((1,), dtype=np.float64, buffer=self.shm.buf, offset=16)
+        self.frame = np.ndarray((length,), dtype=dtype, buffer=self.shm.buf, offset=24)
+        self.lastGood = None # (frame, fc, ts) of the last consistent read
+
+    def history(self):
+        return FrameHistory(*self.historyShape, buffer=self.shm.buf, offset=self.historyOffset)
+
+    def publish(self, pressure, fc, ts):
+        self.counters[0] += 1
+        np.copyto(self.frame, pressure)
+        self.ts[0] = ts
+        self.counters[1] = fc
+        self.counters[0] += 1
+
+    def read(self, out):
+        # Copies the latest frame into out, retrying if the worker published a new one meanwhile. A worker that died
+        # mid-publish leaves the sequence odd for good, so after READ_RETRIES the last consistent frame is returned.
+        for attempt in range(self.READ_RETRIES):
+            seq = self.counters[0]
+            if seq % 2 == 0:
+                np.copyto(out, self.frame)
+                fc = int(self.counters[1])
+                ts = float(self.ts[0])
+                if self.counters[0] == seq:
+                    if self.lastGood is None:
+                        self.lastGood = (np.empty_like(self.frame), 0, 0.0)
+                    np.copyto(self.lastGood[0], out)
+                    self.lastGood = (self.lastGood[0], fc, ts)
+                    return fc, ts
+        if self.lastGood is None:
+            out[:] = 0
+            return 0, 0.0
+        frame, fc, ts = self.lastGood
+        np.copyto(out, frame)
+        return fc, ts
+
+    def release(self):
+        # Only the creating (parent) process unlinks the block
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedSensorView():
+    # Read-only stand-in for a Sensor whose frames are assembled in an ingest worker process
+    def __init__(self, sensor, sharedFrame):
+        self.id = sensor.id
+        self.selWires = sensor.selWires
+        self.readWires = sensor.readWires
+        self.deviceName = sensor.deviceName
+        self.path = sensor.path
+        self.sharedFrame = sharedFrame
+        self.history = sharedFrame.history()
+
+    @property
+    def pressure(self):
+        return self.snapshot()[0]
+
+    def snapshot(self, copy=True):
+        # Frames live in another process, so a consistent snapshot is always a copy
+        frame, fc, ts = self.latest_frame()
+        return frame.reshape(-1), fc
+
+    def latest_frame(self):
+        frame = np.empty_like(self.sharedFrame.frame)
+        fc, ts = self.sharedFrame.read(frame)
+        frame.flags.writeable = False
+        return frame.reshape(self.selWires, self.readWires), fc, ts
+
+    def framesSince(self, seq, copy=True):
+        # The worker keeps appending while the ring is copied, overwriting the oldest slots first. An append writes its
+        # slot before advancing the count, so after copying, every frame older than count-size+2 may be torn (the
+        # newest such slot may be mid-write for frame count+1) and is dropped.
+        frames, ts, predicted, first = self.history.since(seq, copy=True)
+        oldestSafe = int(self.history.count[0])-self.history.size+2
+        if first < oldestSafe:
+            skip = min(oldestSafe-first, len(frames))
+            frames, ts, predicted, first = frames[skip:], ts[skip:], predicted[skip:], first+skip
+        return frames, ts, predicted, first
+
+    @property
+    def fc(self):
+        return int(self.sharedFrame.counters[1])
+
+    @property
+    def init(self):
+        return self.fc > 0
+
+    @property
+    def lastTs(self):
+        return float(self.sharedFrame.ts[0])
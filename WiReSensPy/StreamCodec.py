@@ -0,0 +1,30 @@
+import zlib
+import numpy as np
+
+# Optional codec for remote visualization streams. Frames are quantized to 8 bits over the receivers' display range
+# (GenericReceiverClass pressure_min, pressure_max, use_log), and each frame a client is sent is the wrapping uint8
+# difference from the last frame that client received, zlib-compressed. Keyframes hold the quantized frame itself.
+
+def quantize(pressure, pressureMin=0, pressureMax=4096, useLog=True):
+    scaled = np.clip(np.asarray(pressure, dtype=np.float32)-pressureMin, 0, pressureMax-pressureMin)
+    if useLog:
+        scaled = np.log1p(scaled)/np.log1p(pressureMax-pressureMin)
+    else:
+        scaled = scaled/(pressureMax-pressureMin)
+    return np.rint(scaled*255).astype(np.uint8)
+
+def dequantizeTable(pressureMin=0, pressureMax=4096, useLog=True):
+    # Reading represented by each of the 256 levels, the inverse of quantize
+    levels = np.arange(256, dtype=np.float64)/255
+    if useLog:
+        return pressureMin+np.expm1(levels*np.log1p(pressureMax-pressureMin))
+    return pressureMin+levels*(pressureMax-pressureMin)
+
+def encodeDelta(quantized, reference=None, level=1):
+    # zlib payload of a keyframe (reference None) or of the wrapping difference from reference
+    data = quantized if reference is None else quantized-reference
+    return zlib.compress(np.ascontiguousarray(data).tobytes(), level)
+
+def decodeDelta(payload, shape, reference=None):
+    data = np.frombuffer(zlib.decompress(payload), dtype=np.uint8).reshape(shape)
+    return data.copy() if reference is None else reference+data
@@ -1,11 +1,16 @@
 import numpy as np
 import json5
-from GenericReceiver import GenericReceiverClass
 import socket
-import select
+from GenericReceiver import GenericReceiverClass
 import threading
+import multiprocessing
+import contextlib
 from typing import List
 from Sensor import Sensor
+from RingBuffer import RingBuffer
+from RecordingReader import RecordingReader
+from Replay import sensorFrames, mergeByTimestamp, pace
+from ShardedIngest import SharedFrame, SharedSensorView
 import aioconsole
 import webbrowser
 
@@ -14,151 +19,277 @@ from bleak import BleakClient, BleakScanner
 from bleak.backends.characteristic import BleakGATTCharacteristic
 import serial_asyncio
 from flaskApp.index import update_sensors, replay_sensors, start_server
+from VizServer import AsyncVizServer
 from remote import startController
 import utils
 
 
 
+class WifiStreamProtocol(asyncio.BufferedProtocol):
+    # The event loop receives straight into the connection's ring buffer (recv_into), and whole packets
+    # are decoded from memoryview slices of it
+    def __init__(self, receiver):
+        self.receiver = receiver
+        self.ring = RingBuffer(receiver.packetSize*64)
+        self.transport = None
+        self.sensorId = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.ring.writable()
+
+    def buffer_updated(self, nbytes):
+        self.ring.advance(nbytes)
+        receiver = self.receiver
+        packets = receiver.unpackBytesPackets(self.ring.fixedBlock(receiver.packetSize))
+        receiver.logPackets(packets)
+        if len(packets) == 0:
+            return
+        if self.sensorId is None:
+            # The first packet identifies which sensor is on the other end of this connection
+            sendId = int(packets['sendId'][0])
+            if sendId not in receiver.sensors:
+                print(f"Connection refused from {self.transport.get_extra_info('peername')}")
+                self.transport.close()
+                return
+            self.sensorId = sendId
+            receiver.registerConnection(sendId, self.transport)
+        receiver.lastSeen[self.sensorId] = receiver.loop.time()
+        receiver.dispatchPackets(packets)
+
+    def connection_lost(self, exc):
+        if self.sensorId is not None:
+            print(f"Sensor {self.sensorId} is disconnected: waiting for it to reconnect...")
+            self.receiver.unregisterConnection(self.sensorId, self.transport)
+
+
 class WifiReceiver(GenericReceiverClass):
-    def __init__(self,numNodes,sensors:List[Sensor], tcp_ip="10.0.0.67", tcp_port=7000, record=True, stopFlag=None):
+    TRANSPORT = "wifi"
+
+    def __init__(self,numNodes,sensors:List[Sensor], tcp_ip="10.0.0.67", tcp_port=7000, record=True, stopFlag=None, timeout=30):
         super().__init__(numNodes,sensors,record)
         self.TCP_IP = tcp_ip
         self.tcp_port = tcp_port
         self.connection_is_open = False
         self.connections = {}
-        self.setup_TCP()
+        self.lastSeen = {}
+        self.timeout = timeout
         self.stopFlag = stopFlag
-    
-    def setup_TCP(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind((self.TCP_IP, self.tcp_port))
-        sock.listen(len(self.sensors))  # Listen for N connections
+        self.loop = None
+
+    def registerConnection(self, sensorId, transport):
+        # A sensor that reconnects replaces its previous (stale) connection
+        stale = self.connections.get(sensorId)
+        if stale is not None and stale is not transport:
+            print(f"Replacing stale connection for sensor {sensorId}")
+            stale.close()
+        self.connections[sensorId] = transport
+        self.lastSeen[sensorId] = self.loop.time()
+        print(f"Connection from Sensor {sensorId} found")
+
+    def unregisterConnection(self, sensorId, transport):
+        if self.connections.get(sensorId) is transport:
+            del self.connections[sensorId]
+
+    async def watchConnections(self):
+        # Closing an idle connection drops only that sensor; the listener keeps accepting its reconnect
+        while not self.stopFlag.is_set():
+            now = self.loop.time()
+            for sensorId, transport in list(self.connections.items()):
+                if now - self.lastSeen[sensorId] > self.timeout:
+                    print(f"Sensor {sensorId} timed out")
+                    transport.close()
+            try:
+                await asyncio.wait_for(self.stopFlag.wait(), self.timeout/2)
+            except asyncio.TimeoutError:
+                pass
+
+    async def serveStreams(self):
+        self.loop = asyncio.get_running_loop()
+        server = await self.loop.create_server(lambda: WifiStreamProtocol(self), self.TCP_IP, self.tcp_port)
         print("Waiting for connections")
-        while len(self.connections) < len(self.sensors):
-            connection, client_address = sock.accept()
-            print("Connection found")
-            sensorId = self.getSensorIdFromBuffer(connection)
-            print(f"Connection found from {sensorId}")
-            self.connections[sensorId]=connection
-        sock.settimeout(30)
-        print("All connections found")
-
-    def getSensorIdFromBuffer(self, connection):
+        async with server:
+            await self.watchConnections()
+        for transport in list(self.connections.values()):
+            transport.close()
+
+    def startReceiverThreads(self):
+        return [self.serveStreams()]
+
+
+class WifiUdpReceiver(GenericReceiverClass):
+    TRANSPORT = "wifi-udp"
+
+    # Datagram transport: a lost packet is predicted instead of stalling the stream behind a TCP retransmit
+    def __init__(self,numNodes,sensors:List[Sensor], udp_ip="10.0.0.67", udp_port=7000, record=True, stopFlag=None, reorderWindow=64):
+        super().__init__(numNodes,sensors,record)
+        self.UDP_IP = udp_ip
+        self.udp_port = udp_port
+        self.stopFlag = stopFlag
+        self.reorderWindow = reorderWindow
+        self.datagram = bytearray(self.packetSize+1) # one spare byte to detect oversized datagrams
+        self.expectedPackets = {}
+        self.lostPackets = {sensorId: 0 for sensorId in self.sensors}
+        self.latePackets = {sensorId: 0 for sensorId in self.sensors}
+        self.malformedPackets = 0
+        self.datagramErrorReported = False
+
+    def handleDatagram(self, data):
+        sendId, startIdx, sensorReadings, packet = self.unpackBytesPacket(data)
+        if sendId not in self.sensors:
+            return
+        if startIdx != 20000 and startIdx >= self.sensors[sendId].pressureLength:
+            # Datagrams are not trusted input; a start index outside the frame cannot be assembled
+            self.malformedPackets += 1
+            return
+        if startIdx == 20000:
+            self.logPackets(self.unpackBytesPackets(data))
+            self.dispatchPacket(sendId, startIdx, sensorReadings, packet)
+            return
+        expected = self.expectedPackets.get(sendId)
+        if expected is not None:
+            if expected - self.reorderWindow < packet < expected:
+                # Late (reordered or duplicated) packet: its slot has already been predicted or filled
+                self.latePackets[sendId] += 1
+                return
+            if packet > expected:
+                self.lostPackets[sendId] += packet-expected
+        self.expectedPackets[sendId] = packet+1
+        self.logPackets(self.unpackBytesPackets(data))
+        # Gaps in the packet numbers are filled by the sensor's intermittent prediction path
+        self.sensors[sendId].processRowIntermittent(startIdx,sensorReadings,packet,record=self.record)
+
+    async def receiveDatagrams(self, sock):
+        loop = asyncio.get_running_loop()
+        view = memoryview(self.datagram)
         while True:
-            ready_to_read, ready_to_write, in_error = select.select([connection], [], [], 30)
-            if len(ready_to_read)>0:
-                numBytes = 1+(self.numNodes+1)*2+4
-                inBuffer =   connection.recv(numBytes, socket.MSG_PEEK)
-                if len(inBuffer) >= numBytes:
-                    sendId, startIdx, sensorReadings, packet = self.unpackBytesPacket(inBuffer)
-                return sendId
-
-    def reconnect(self, sensorId):
-        print(f"Reconnecting to sensor {sensorId}")
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            nbytes = await loop.sock_recv_into(sock, view)
+            if nbytes != self.packetSize:
+                self.malformedPackets += 1
+                continue
+            try:
+                self.handleDatagram(view[:nbytes])
+            except Exception as e:
+                # One bad datagram costs that packet, not the stream
+                if not self.datagramErrorReported:
+                    print(f"Dropping datagram that could not be processed: {e!r}")
+                    self.datagramErrorReported = True
+                self.malformedPackets += 1
+
+    async def serveDatagrams(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind((self.TCP_IP, self.tcp_port))
-        sock.listen(len(self.sensors))
-        print("waiting for connections")
-        found_Conn = False
-        while not found_Conn:
-            connection, client_address = sock.accept()
-            connectionSensorId = self.getSensorIdFromBuffer(connection)
-            if connectionSensorId == sensorId:
-                print(f"Connection from Sensor {sensorId} found")
-                self.connections[sensorId]=connection
-                found_Conn = True
-            else:
-                print(f"Connection refused from {client_address}")
-                connection.close()
-
-    async def receiveData(self, sensorId):
-        print("Receiving Data")
-        while not self.stopFlag.is_set():
-            connection = self.connections[sensorId]
-            ready_to_read, ready_to_write, in_error = await asyncio.get_event_loop().run_in_executor(
-                None, select.select, [connection], [], [], 30)
-            if len(ready_to_read)>0:
-                numBytes = 1+(self.numNodes+1)*2+4
-                inBuffer =   await asyncio.get_event_loop().run_in_executor(None, connection.recv, numBytes, socket.MSG_PEEK)
-                if len(inBuffer) >= numBytes:
-                    data = await asyncio.get_event_loop().run_in_executor(None, connection.recv, numBytes)
-                    sendId, startIdx, sensorReadings, packet = self.unpackBytesPacket(data)
-                    sensor = self.sensors[sendId]
-                    if(sensor.intermittent):
-                        sensor.processRowIntermittent(startIdx,sensorReadings,packet,record=self.record)
-                    else:
-                        if (startIdx==20000):
-                            sensor.processRowReadNode(sensorReadings,packet,record=self.record)
-                        else:
-                            sensor.processRow(startIdx,sensorReadings,packet,record=self.record)
-            else:
-                print(f"Sensor {sensorId} is disconnected: Reconnecting...")
-                await asyncio.get_event_loop().run_in_executor(None, connection.shutdown, 2)
-                await asyncio.get_event_loop().run_in_executor(None, connection.close)
-                self.reconnect(sensorId)
+        sock.bind((self.UDP_IP, self.udp_port))
+        sock.setblocking(False)
+        print("Waiting for datagrams")
+        receiveTask = asyncio.create_task(self.receiveDatagrams(sock))
+        await self.stopFlag.wait()
+        receiveTask.cancel()
+        sock.close()
+        print(f"Lost packets: {self.lostPackets}, late packets: {self.latePackets}")
 
     def startReceiverThreads(self):
-        tasks = []
-        for sensorId in self.connections:
-            task = self.receiveData(sensorId)
-            tasks.append(task)
-        return tasks
+        return [self.serveDatagrams()]
 
 
 class BLEReceiver(GenericReceiverClass):
-    def __init__(self, numNodes, sensors: List[Sensor],record=True):
+    TRANSPORT = "ble"
+
+    NOTIFY_UUID = "1766324e-8b30-4d23-bff2-e5209c3d986f"
+
+    # scanner and clientFactory default to bleak; a fake client that replays recorded notifications can be injected instead
+    def __init__(self, numNodes, sensors: List[Sensor],record=True, queueSize=256, batchSize=32, scanner=BleakScanner, clientFactory=BleakClient):
         super().__init__(numNodes, sensors, record)
         self.deviceNames = [sensor.deviceName for sensor in sensors]
         self.clients={}
+        self.batchSize = batchSize
+        self.scanner = scanner
+        self.clientFactory = clientFactory
+        # Notifications are only copied into a bounded per-device queue; frame assembly and recording happen in a consumer task
+        self.queues = {deviceName: asyncio.Queue(maxsize=queueSize) for deviceName in self.deviceNames}
+        self.queueOverflows = {deviceName: 0 for deviceName in self.deviceNames}
+        self.malformedPackets = 0
+
+    def queueDepths(self):
+        return {deviceName: queue.qsize() for deviceName, queue in self.queues.items()}
+
+    def enqueue(self, deviceName, data):
+        queue = self.queues[deviceName]
+        if queue.full():
+            # Drop the oldest notification so the newest data keeps flowing
+            queue.get_nowait()
+            self.queueOverflows[deviceName] += 1
+        queue.put_nowait(data)
+
+    def onNotification(self, deviceName, data):
+        self.enqueue(deviceName, bytes(data))
+
+    async def consumeNotifications(self, deviceName):
+        queue = self.queues[deviceName]
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty() and len(batch) < self.batchSize:
+                batch.append(queue.get_nowait())
+            if batch[-1] is None:
+                # stopReceiver's sentinel
+                batch.pop()
+                self.processBatch(batch)
+                return
+            self.processBatch(batch)
+
+    def processBatch(self, batch):
+        valid = [data for data in batch if data is not None and len(data) == self.packetSize]
+        self.malformedPackets += len(batch) - len(valid)
+        if len(valid) > 0:
+            packets = self.unpackBytesPackets(b''.join(valid))
+            self.logPackets(packets)
+            self.dispatchPackets(packets)
 
     async def connect_to_device(self, lock, deviceName):
         def on_disconnect(client):
             print(f"Device {deviceName} disconnected, attempting to reconnect...")
             asyncio.create_task(self.connect_to_device(lock, deviceName))
         async with lock:
-            device = await BleakScanner.find_device_by_name(deviceName,timeout=30)
+            device = await self.scanner.find_device_by_name(deviceName,timeout=30)
             if device:
                 print(f"Found device: {deviceName}")
-                client = BleakClient(device)
+                client = self.clientFactory(device)
                 client.set_disconnected_callback(on_disconnect)
                 self.clients[deviceName] = client
                 await client.connect()
 
         def notification_handler(characteristic: BleakGATTCharacteristic, data: bytearray):
-            sendId, startIdx, sensorReadings, packet = self.unpackBytesPacket(data)
-            sensor = self.sensors[sendId]
-            if(sensor.intermittent):
-                sensor.processRowIntermittent(startIdx,sensorReadings,packet,record=self.record)
-            else:
-                if (startIdx==20000):
-                    sensor.processRowReadNode(sensorReadings,packet,record=self.record)
-                else:
-                    sensor.processRow(startIdx,sensorReadings,packet,record=self.record)
-
-
-        await client.start_notify("1766324e-8b30-4d23-bff2-e5209c3d986f", notification_handler)
+            self.onNotification(deviceName, data)
+
+
+        await client.start_notify(self.NOTIFY_UUID, notification_handler)
         print(f"Connected to {deviceName}")
     
     async def stopReceiver(self):
         for client in self.clients.values():
-            await client.stop_notify("1766324e-8b30-4d23-bff2-e5209c3d986f")
+            await client.stop_notify(self.NOTIFY_UUID)
             await client.disconnect()
+        for deviceName in self.queues:
+            self.enqueue(deviceName, None)
         print("All notifications stopped and devices disconnected.")
+        print(f"Notification queue overflows: {self.queueOverflows}")
 
     def startReceiverThreads(self):
         lock = asyncio.Lock()
         tasks = [self.connect_to_device(lock, name) for name in self.deviceNames]
+        tasks += [self.consumeNotifications(name) for name in self.queues]
         return tasks
 
 
     
 
-
 class SerialReceiver(GenericReceiverClass):
-    def __init__(self, numNodes, sensors, port, baudrate, stopFlag=None, record =True):
-        super().__init__(numNodes, sensors, record)
+    TRANSPORT = "serial"
+
+    def __init__(self, numNodes, sensors, port, baudrate, stopFlag=None, record =True, framing="delimiter", checksum=False):
+        super().__init__(numNodes, sensors, record, framing, checksum)
         self.port = port #update serial port
         self.baudrate = baudrate
         self.stop_capture_event = False
@@ -193,44 +324,102 @@ def readConfigFile(file):
         data = json5.load(file)
     return data
 
+def buildSensor(sensorConfig, config):
+    sensorKeys = list(sensorConfig.keys())
+    intermittent = False
+    p = 15
+
+    if 'intermittent' in sensorKeys:
+        intermittent = sensorConfig['intermittent']['enabled']
+        p = sensorConfig['intermittent']['p']
+
+    deviceName = "Esp1"
+    userNumNodes = 256
+
+    match sensorConfig['protocol']:
+        case 'wifi' | 'wifi-udp':
+            userNumNodes = config['wifiOptions']['numNodes']
+        case 'ble':
+            deviceName = sensorConfig['deviceName']
+            userNumNodes = config['bleOptions']['numNodes']
+        case 'serial':
+            userNumNodes = config['serialOptions']['numNodes']
+
+    numGroundWires = sensorConfig['endCoord'][1] - sensorConfig['startCoord'][1] + 1
+    numReadWires = sensorConfig['endCoord'][0] - sensorConfig['startCoord'][0] + 1
+    numNodes = min(userNumNodes, numGroundWires*numReadWires)
+    return Sensor(numGroundWires,numReadWires,numNodes,sensorConfig['id'],deviceName=deviceName,intermittent=intermittent, p=p,
+                  historySize=sensorConfig.get('historyFrames', 64), recordingOptions=config.get('recordingOptions', {}))
+
+def closeRecordings(sensors):
+    # Closes every sensor's recording, then raises the first recording error, so one failed file does not leave the
+    # others unflushed
+    errors = []
+    for sensor in sensors:
+        try:
+            sensor.closeRecording()
+        except RuntimeError as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
+
+def createReceiver(config, protocol, sensors, record, stopFlag):
+    match protocol:
+        case 'ble':
+            return BLEReceiver(config['bleOptions']['numNodes'],sensors, record,
+                               queueSize=config['bleOptions'].get('queueSize', 256), batchSize=config['bleOptions'].get('batchSize', 32))
+        case 'wifi':
+            return WifiReceiver(config['wifiOptions']['numNodes'],sensors,config['wifiOptions']['tcp_ip'],config['wifiOptions']['port'], stopFlag=stopFlag, record=record, timeout=config['wifiOptions'].get('timeout', 30))
+        case 'wifi-udp':
+            return WifiUdpReceiver(config['wifiOptions']['numNodes'],sensors,config['wifiOptions']['tcp_ip'],config['wifiOptions'].get('udpPort', config['wifiOptions']['port']), stopFlag=stopFlag, record=record)
+        case 'serial':
+            return SerialReceiver(config['serialOptions']['numNodes'],sensors,config['serialOptions']['port'],config['serialOptions']['baudrate'],stopFlag=stopFlag,record=record,
+                                  framing=config['serialOptions'].get('framing', "delimiter"), checksum=config['serialOptions'].get('checksum', False))
+
+# Entry point of an ingest worker process: assembles frames for its shard of sensors and publishes them to shared memory
+def runIngestShard(config, protocol, sensorSpecs, record, stopEvent):
+    sensors = []
+    for sensorConfig, path, sharedFrameName in sensorSpecs:
+        sensor = buildSensor(sensorConfig, config)
+        sensor.path = path
+        sensor.sharedFrame = SharedFrame(sensor.pressureLength, sensor.pressure.dtype, name=sharedFrameName,
+                                         historyShape=(sensor.history.size, sensor.selWires, sensor.readWires))
+        # The frame history lives in shared memory too, so the parent's views can serve framesSince
+        sensor.history = sensor.sharedFrame.history()
+        sensors.append(sensor)
+
+    async def runShard():
+        stopFlag = asyncio.Event()
+        receiver = createReceiver(config, protocol, sensors, record, stopFlag)
+        async def waitForStop():
+            await asyncio.get_running_loop().run_in_executor(None, stopEvent.wait)
+            stopFlag.set()
+            if isinstance(receiver, BLEReceiver):
+                await receiver.stopReceiver()
+        await asyncio.gather(*receiver.startReceiverThreads(), waitForStop())
+        receiver.closePacketLogs()
+
+    asyncio.run(runShard())
+    closeRecordings(sensors)
+
 class MultiProtocolReceiver():
     def __init__(self, configFilePath="./WiSensConfigClean.json"):
         self.config = readConfigFile(configFilePath)
         self.sensors = self.config['sensors']
         self.bleSensors = []
         self.wifiSensors = []
+        self.udpSensors = []
         self.serialSensors = []
         self.allSensors = []
         self.stopFlag = asyncio.Event()
         for sensorConfig in self.sensors:
-            sensorKeys = list(sensorConfig.keys())
-            intermittent = False
-            p = 15
-
-            if 'intermittent' in sensorKeys:
-                intermittent = sensorConfig['intermittent']['enabled']
-                p = sensorConfig['intermittent']['p']
-
-            deviceName = "Esp1"
-            userNumNodes = 256
-
-            match sensorConfig['protocol']:
-                case 'wifi':
-                    userNumNodes = self.config['wifiOptions']['numNodes']
-                case 'ble':
-                    deviceName = sensorConfig['deviceName']
-                    userNumNodes = self.config['bleOptions']['numNodes']
-                case 'serial':
-                    userNumNodes = self.config['serialOptions']['numNodes']
-
-            numGroundWires = sensorConfig['endCoord'][1] - sensorConfig['startCoord'][1] + 1
-            numReadWires = sensorConfig['endCoord'][0] - sensorConfig['startCoord'][0] + 1
-            numNodes = min(userNumNodes, numGroundWires*numReadWires)
-            newSensor = Sensor(numGroundWires,numReadWires,numNodes,sensorConfig['id'],deviceName=deviceName,intermittent=intermittent, p=p)
+            newSensor = buildSensor(sensorConfig, self.config)
             
             match sensorConfig['protocol']:
                 case 'wifi':
                     self.wifiSensors.append(newSensor)
+                case 'wifi-udp':
+                    self.udpSensors.append(newSensor)
                 case 'ble':
                     self.bleSensors.append(newSensor)
                 case 'serial':
@@ -239,9 +428,14 @@ class MultiProtocolReceiver():
 
         self.receivers = []
         self.receiveTasks = []
+        self.shards = []
+        self.vizServer = None
     
     async def startReceiversAsync(self):
         await asyncio.gather(*self.receiveTasks)
+        for receiver in self.receivers:
+            receiver.closePacketLogs()
+        closeRecordings([sensor for sensor in self.allSensors if isinstance(sensor, Sensor)])
         # await self.listen_for_stop()
 
     async def listen_for_stop(self):
@@ -259,20 +453,78 @@ class MultiProtocolReceiver():
 
 
     def initializeReceivers(self,record):
-        if len(self.bleSensors)!=0:
-            bleReceiver = BLEReceiver(self.config['bleOptions']['numNodes'],self.bleSensors, record)
-            self.receivers.append(bleReceiver)
-            self.receiveTasks += bleReceiver.startReceiverThreads()
-        if len(self.wifiSensors)!=0:
-            wifiReceiver = WifiReceiver(self.config['wifiOptions']['numNodes'],self.wifiSensors,self.config['wifiOptions']['tcp_ip'],self.config['wifiOptions']['port'], stopFlag=self.stopFlag, record=record)
-            self.receivers.append(wifiReceiver)
-            self.receiveTasks += wifiReceiver.startReceiverThreads()
-        if len(self.serialSensors)!=0:
-            serialReceiver = SerialReceiver(self.config['serialOptions']['numNodes'],self.serialSensors,self.config['serialOptions']['port'],self.config['serialOptions']['baudrate'],stopFlag=self.stopFlag,record=record)
-            self.receivers.append(serialReceiver)
-            self.receiveTasks += serialReceiver.startReceiverThreads()
+        ingestOptions = self.config.get('ingestOptions', {})
+        if ingestOptions.get('mode', "single") == "sharded":
+            self.initializeShards(record, ingestOptions.get('sensorsPerShard', None))
+            self.receiveTasks.append(self.listen_for_stop())
+            return
+        for protocol, sensors in [('ble', self.bleSensors), ('wifi', self.wifiSensors), ('wifi-udp', self.udpSensors), ('serial', self.serialSensors)]:
+            if len(sensors)!=0:
+                receiver = createReceiver(self.config, protocol, sensors, record, self.stopFlag)
+                self.receivers.append(receiver)
+                self.receiveTasks += receiver.startReceiverThreads()
         self.receiveTasks.append(self.listen_for_stop())
 
+    def initializeShards(self, record, sensorsPerShard=None):
+        # One worker process per protocol. BLE sensors can be split further into groups of sensorsPerShard;
+        # wifi, wifi-udp and serial sensors share a single listening port / serial port, so they stay in one shard.
+        context = multiprocessing.get_context("spawn")
+        self.shardStopEvent = context.Event()
+        sensorConfigs = {sensorConfig['id']: sensorConfig for sensorConfig in self.sensors}
+        views = {}
+        for protocol, sensors in [('ble', self.bleSensors), ('wifi', self.wifiSensors), ('wifi-udp', self.udpSensors), ('serial', self.serialSensors)]:
+            groupSize = sensorsPerShard if protocol == 'ble' and sensorsPerShard else max(len(sensors), 1)
+            for i in range(0, len(sensors), groupSize):
+                sensorSpecs = []
+                for sensor in sensors[i:i+groupSize]:
+                    sharedFrame = SharedFrame(sensor.pressureLength, sensor.pressure.dtype,
+                                              historyShape=(sensor.history.size, sensor.selWires, sensor.readWires))
+                    views[sensor.id] = SharedSensorView(sensor, sharedFrame)
+                    sensorSpecs.append((sensorConfigs[sensor.id], sensor.path, sharedFrame.name))
+                process = context.Process(target=runIngestShard, args=(self.config, protocol, sensorSpecs, record, self.shardStopEvent), daemon=True)
+                self.shards.append(process)
+        # Visualization and custom methods read the worker-published frames through read-only views
+        self.allSensors = [views[sensor.id] for sensor in self.allSensors]
+        self.receiveTasks.append(self.runShards())
+
+    async def runShards(self):
+        for process in self.shards:
+            process.start()
+        await self.stopFlag.wait()
+        self.shardStopEvent.set()
+        loop = asyncio.get_running_loop()
+        for process in self.shards:
+            await loop.run_in_executor(None, process.join)
+        for sensor in self.allSensors:
+            sensor.sharedFrame.release()
+
+    def vizOptions(self):
+        vizOptions = dict(self.config.get('vizOptions', {}))
+        # The stream codec quantizes over the receivers' display range
+        receiver = self.receivers[0] if self.receivers else GenericReceiverClass
+        vizOptions['quantization'] = {'pressureMin': receiver.pressure_min, 'pressureMax': receiver.pressure_max, 'useLog': receiver.use_log}
+        return vizOptions
+
+    def addVizServer(self):
+        # With vizOptions.server "async", the visualization server runs on the receivers' event loop; it must be
+        # added before the capture thread starts that loop
+        vizOptions = self.vizOptions()
+        if vizOptions.get('server', "flask") == "async":
+            self.vizServer = AsyncVizServer(self.allSensors, vizOptions)
+            self.receiveTasks.append(self.vizServer.serve(self.stopFlag))
+
+    def startVisualization(self, threads):
+        # The Flask server needs a publishing thread, and blocks this thread while it serves
+        if self.vizServer is None:
+            vizThread = threading.Thread(target=update_sensors, args=(self.allSensors, self.vizOptions()))
+            vizThread.start()
+            threads.append(vizThread)
+        utils.start_nextjs()
+        url = "http://localhost:3000"
+        webbrowser.open_new_tab(url)
+        if self.vizServer is None:
+            start_server()
+
     def startReceiverThread(self):
         asyncio.run(self.startReceiversAsync())
 
@@ -284,55 +536,52 @@ class MultiProtocolReceiver():
 
     def visualizeAndRecord(self):
         self.initializeReceivers(True)
+        self.addVizServer()
         threads=[]
         captureThread = threading.Thread(target=self.startReceiverThread)
         captureThread.start()
         threads.append(captureThread)
-        vizThread = threading.Thread(target=update_sensors, args=(self.allSensors,))
-        vizThread.start()
-        threads.append(vizThread)
-        utils.start_nextjs()
-        url = "http://localhost:3000"
-        webbrowser.open_new_tab(url)
-        start_server()
+        self.startVisualization(threads)
         for thread in threads:
             thread.join()
 
 
     def visualize(self):
         self.initializeReceivers(False)
+        self.addVizServer()
         threads=[]
         captureThread = threading.Thread(target=self.startReceiverThread)
         captureThread.start()
         threads.append(captureThread)
-        vizThread = threading.Thread(target=update_sensors, args=(self.allSensors,))
-        vizThread.start()
-        threads.append(vizThread)
-        utils.start_nextjs()
-        url = "http://localhost:3000"
-        webbrowser.open_new_tab(url)
-        start_server()
+        self.startVisualization(threads)
         for thread in threads:
             thread.join()
 
     def replayData(self,fileDict, startTs=None,endTs=None, speed=1):
-        pressureDict = {}
-        totalFrames = None
-        frameRate = None
-        for sensorId in fileDict:
-            pressure, fc, ts = utils.tactile_reading(fileDict[sensorId])
-            startIdx = 0
-            beginTs = ts[0]
-            if startTs is not None:
-                startIdx,beginTs = utils.find_closest_index(ts,startTs)
-            endIdx, lastTs = len(ts), ts[-1]
-            if endTs is not None:
-                endIdx, lastTs = utils.find_closest_index(ts, endTs)
-            if totalFrames is None or endIdx-startIdx<totalFrames:
-                totalFrames = endIdx-startIdx
-                frameRate = (totalFrames/(lastTs-beginTs)) * speed
-            pressureDict[sensorId] = pressure[startIdx:endIdx,:,:]
-        vizThread = threading.Thread(target=replay_sensors, args=(pressureDict,frameRate,totalFrames,))
+        # Sensors are merged by timestamp and each frame is shown at its own recorded time, scaled by speed.
+        # Frames are streamed from disk as playback proceeds.
+        streams = []
+        with contextlib.ExitStack() as stack:
+            for sensorId in fileDict:
+                reader = stack.enter_context(RecordingReader(fileDict[sensorId]))
+                start, stop = reader.frameWindow(startTs, endTs)
+                streams.append(sensorFrames(sensorId, reader, start, stop))
+            readers = stack.pop_all()
+        batches = pace(mergeByTimestamp(streams), speed)
+        vizOptions = self.vizOptions()
+        if vizOptions.get('server', "flask") == "async":
+            # Served like live data with vizOptions.server "async", on an event loop run by this thread
+            async def replay():
+                with readers:
+                    await AsyncVizServer([], vizOptions).serveReplay(batches, self.stopFlag)
+            utils.start_nextjs()
+            asyncio.run(replay())
+            return
+        def replay():
+            # The readers stay open until playback ends
+            with readers:
+                replay_sensors(batches, vizOptions)
+        vizThread = threading.Thread(target=replay)
         vizThread.start()
         utils.start_nextjs()
         url = "http://localhost:3000"
@@ -342,6 +591,8 @@ class MultiProtocolReceiver():
     # Sends all sensors (with real time pressure updates) as input to the custom method
     def runCustomMethod(self, method, record=False, viz=False):
         self.initializeReceivers(record)
+        if viz:
+            self.addVizServer()
         threads=[]
         captureThread = threading.Thread(target=self.startReceiverThread)
         captureThread.start()
@@ -350,13 +601,7 @@ class MultiProtocolReceiver():
         customThread.start()
         threads.append(customThread)
         if viz:
-            vizThread = threading.Thread(target=update_sensors, args=(self.allSensors,))
-            vizThread.start()
-            threads.append(vizThread)
-            utils.start_nextjs()
-            url = "http://localhost:3000"
-            webbrowser.open_new_tab(url)
-            start_server()
+            self.startVisualization(threads)
         for thread in threads:
             thread.join()
         
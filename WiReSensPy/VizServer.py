@@ -0,0 +1,110 @@
+import asyncio
+import socketio
+import tornado.web
+from flaskApp.index import VizEmitter, parse_subscription, publish_batch
+
+class StatusHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write("WebSocket server is running...")
+
+class AsyncVizServer():
+    # Production visualization server (vizOptions.server "async"): python-socketio's asyncio server on tornado, run as
+    # a task on the receivers' event loop, or on the loop reading the workers' shared-memory frames in sharded ingest
+    # mode. Sensors are polled with asyncio.sleep instead of a dedicated thread. Each client has a send queue of
+    # sendQueue messages; the emitter skips a client while its queue is full, as it does while the client has too
+    # many unacknowledged messages, so a stalled socket never grows the server's memory.
+    def __init__(self, allSensors, vizOptions=None, host="0.0.0.0", port=5328):
+        vizOptions = vizOptions or {}
+        self.allSensors = allSensors
+        self.host = host
+        self.port = port
+        self.pollInterval = 1/vizOptions.get('pollRate', 200)
+        self.sendQueue = vizOptions.get('sendQueue', 4)
+        self.sio = socketio.AsyncServer(async_mode='tornado', cors_allowed_origins="*")
+        self.emitter = VizEmitter(self.enqueue, ready=self.ready)
+        self.emitter.configure(vizOptions)
+        self.queues = {}
+        self.senders = {}
+        self.sio.on('connect', self.on_connect)
+        self.sio.on('disconnect', self.on_disconnect)
+        self.sio.on('viz_rate', self.on_viz_rate)
+        self.sio.on('subscribe', self.on_subscribe)
+
+    async def on_connect(self, sid, environ, auth=None):
+        self.queues[sid] = asyncio.Queue(self.sendQueue)
+        self.senders[sid] = asyncio.create_task(self.sendLoop(sid, self.queues[sid]))
+        self.emitter.connect(sid)
+        codecOptions = self.emitter.codecOptions()
+        if codecOptions is not None:
+            await self.sio.emit('viz_codec', codecOptions, to=sid)
+
+    async def on_disconnect(self, sid, *args):
+        self.emitter.disconnect(sid)
+        self.queues.pop(sid, None)
+        sender = self.senders.pop(sid, None)
+        if sender is not None:
+            sender.cancel()
+
+    async def on_viz_rate(self, sid, rate):
+        self.emitter.setRate(sid, float(rate))
+
+    async def on_subscribe(self, sid, options):
+        try:
+            sensors, view = parse_subscription(options or {})
+        except (TypeError, ValueError) as e:
+            return {'error': str(e)}
+        self.emitter.subscribe(sid, sensors, view)
+        return {'ok': True}
+
+    def ready(self, client):
+        queue = self.queues.get(client.sid)
+        return queue is not None and not queue.full()
+
+    def enqueue(self, client, message):
+        # Only called for clients that are ready, so the queue has room
+        self.queues[client.sid].put_nowait((message, client.acked))
+
+    async def sendLoop(self, sid, queue):
+        while True:
+            message, acked = await queue.get()
+            await self.sio.emit('sensor_data', message, to=sid, callback=acked)
+
+    def listen(self):
+        app = tornado.web.Application([
+            (r"/socket.io/", socketio.get_tornado_handler(self.sio)),
+            (r"/api/python", StatusHandler),
+        ])
+        return app.listen(self.port, address=self.host)
+
+    def shutdown(self, server):
+        server.stop()
+        for sender in self.senders.values():
+            sender.cancel()
+
+    async def serve(self, stopFlag):
+        # Serves until stopFlag (an asyncio.Event) is set
+        server = self.listen()
+        try:
+            while not stopFlag.is_set():
+                self.emitter.poll(self.allSensors)
+                await asyncio.sleep(self.pollInterval)
+        finally:
+            self.shutdown(server)
+
+    async def serveReplay(self, batches, stopFlag):
+        # Serves a replay instead of live sensors until stopFlag is set: batches yields lists of (ts, sensorId, frame)
+        # when they are due (Replay.pace). Pacing sleeps and reading batches touches the disk, so they are drawn on an
+        # executor thread; each batch is published on the loop, the emitter's only publishing thread.
+        loop = asyncio.get_running_loop()
+        frameCounts = {}
+        def play():
+            for batch in batches:
+                if stopFlag.is_set():
+                    break
+                loop.call_soon_threadsafe(publish_batch, self.emitter, batch, frameCounts)
+        server = self.listen()
+        try:
+            await loop.run_in_executor(None, play)
+            await stopFlag.wait()
+        finally:
+            self.shutdown(server)
@@ -0,0 +1,77 @@
+# Encodes the same synthetic session with each visualization stream encoding and reports bytes and encode time per frame.
+# Run from the WiReSensPy directory: python benchmarks/codecBenchmark.py [--frames 2000] [--size 32] [--keyframe 50]
+import argparse
+import os
+import sys
+import time
+import zlib
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from StreamCodec import quantize, encodeDelta
+from storageBenchmark import syntheticFrames
+
+def raw(frames, keyframeInterval):
+    for frame in frames:
+        yield np.clip(frame, 0, 65535).astype('<u2').tobytes()
+
+def quantized(frames, keyframeInterval):
+    for frame in frames:
+        yield quantize(frame).tobytes()
+
+def deltaCodec(level, mode="diff"):
+    # mode: "diff" (what the codec sends), "xor" against the previous frame, or "keyframe" for every frame
+    def encode(frames, keyframeInterval):
+        reference = None
+        for i, frame in enumerate(frames):
+            levels = quantize(frame)
+            if reference is None or i % keyframeInterval == 0 or mode == "keyframe":
+                yield encodeDelta(levels, None, level)
+            elif mode == "xor":
+                yield zlib.compress((levels ^ reference).tobytes(), level)
+            else:
+                yield encodeDelta(levels, reference, level)
+            reference = levels
+    return encode
+
+def lz4Delta(frames, keyframeInterval):
+    import lz4.frame
+    reference = None
+    for i, frame in enumerate(frames):
+        levels = quantize(frame)
+        data = levels if reference is None or i % keyframeInterval == 0 else levels-reference
+        yield lz4.frame.compress(data.tobytes())
+        reference = levels
+
+ENCODINGS = [
+    ("uint16 frames (binary transport)", raw),
+    ("8-bit quantized, uncompressed", quantized),
+    ("8-bit keyframes only, zlib-1", deltaCodec(1, "keyframe")),
+    ("8-bit xor delta, zlib-1", deltaCodec(1, "xor")),
+    ("8-bit delta, zlib-1 (codec default)", deltaCodec(1)),
+    ("8-bit delta, zlib-6", deltaCodec(6)),
+    ("8-bit delta, lz4", lz4Delta),
+]
+
+def run(frames, encoding, keyframeInterval):
+    start = time.perf_counter()
+    total = sum(len(payload) for payload in encoding(frames, keyframeInterval))
+    elapsed = time.perf_counter()-start
+    return total/len(frames), elapsed/len(frames)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=32)
+    parser.add_argument("--keyframe", type=int, default=50)
+    args = parser.parse_args()
+    frames = syntheticFrames(args.frames, args.size)
+    print(f"{args.frames} frames of {args.size}x{args.size}, keyframe every {args.keyframe} frames")
+    print(f"{'encoding':<40}{'bytes/frame':>14}{'us/frame':>12}{'kB/s at 50 fps':>16}")
+    for name, encoding in ENCODINGS:
+        try:
+            bytesPerFrame, secondsPerFrame = run(frames, encoding, args.keyframe)
+        except ImportError as e:
+            print(f"{name:<40}skipped: {e}")
+            continue
+        print(f"{name:<40}{bytesPerFrame:>14.0f}{secondsPerFrame*1e6:>12.1f}{bytesPerFrame*50/1e3:>16.1f}")
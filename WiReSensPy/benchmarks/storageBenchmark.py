@@ -0,0 +1,61 @@
+# Records the same synthetic session with each storage layout and reports write throughput and file size.
+# Run from the WiReSensPy directory: python benchmarks/storageBenchmark.py [--frames 20000] [--size 32]
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Recorder import Recorder
+
+LAYOUTS = [
+    ("int32, auto chunks (previous)", dict(dtype="int32")),
+    ("uint16, 64-frame chunks", dict(dtype="uint16", chunkFrames=64)),
+    ("uint16, 64-frame chunks, lzf", dict(dtype="uint16", chunkFrames=64, compression="lzf")),
+    ("uint16, 64-frame chunks, gzip-1", dict(dtype="uint16", chunkFrames=64, compression="gzip-1")),
+    ("uint16, 64-frame chunks, gzip-4", dict(dtype="uint16", chunkFrames=64, compression="gzip-4")),
+    ("uint16, 64-frame chunks, blosc-lz4", dict(dtype="uint16", chunkFrames=64, compression="blosc-lz4")),
+]
+
+def syntheticFrames(count, size, seed=0):
+    # 12-bit readings: a slowly moving contact blob over a noisy baseline
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size]
+    frames = np.empty((count, size*size))
+    for i in range(count):
+        cx = size/2 + size/4*np.sin(i/200)
+        cy = size/2 + size/4*np.cos(i/300)
+        blob = 3000*np.exp(-((x-cx)**2+(y-cy)**2)/(2*(size/8)**2))
+        frames[i] = (blob + rng.normal(200, 20, (size, size))).reshape(-1)
+    return np.clip(frames, 0, 4095)
+
+def run(frames, size, options, directory):
+    path = os.path.join(directory, "benchmark.hdf5")
+    recorder = Recorder(path, size, size, 1, queueSize=len(frames)+1, **options)
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        recorder.submit(float(i), frame, 0, [i])
+    recorder.close()
+    elapsed = time.perf_counter()-start
+    fileSize = os.path.getsize(path)
+    os.remove(path)
+    return len(frames)/elapsed, fileSize
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=32)
+    args = parser.parse_args()
+    frames = syntheticFrames(args.frames, args.size)
+    print(f"{args.frames} frames of {args.size}x{args.size}")
+    print(f"{'layout':<40}{'frames/s':>12}{'MB':>10}{'bytes/frame':>14}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, options in LAYOUTS:
+            try:
+                throughput, fileSize = run(frames, args.size, options, directory)
+            except ValueError as e:
+                print(f"{name:<40}skipped: {e}")
+                continue
+            print(f"{name:<40}{throughput:>12.0f}{fileSize/1e6:>10.2f}{fileSize/args.frames:>14.0f}")
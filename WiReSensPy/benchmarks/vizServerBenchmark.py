@@ -0,0 +1,108 @@
+# Runs the async visualization server (vizOptions.server "async") in its own process on synthetic sensors that produce
+# a new frame at --rate fps, connects increasing numbers of websocket clients, and reports the frame rate each client
+# actually receives. A client count is sustained when the slowest client gets at least 95% of --rate.
+# Clients speak just enough of the Socket.IO protocol to receive and acknowledge sensor_data, all in this process, so
+# at high client counts this process can become the bottleneck before the server does; watch the server CPU column.
+# Run from the WiReSensPy directory: python benchmarks/vizServerBenchmark.py [--clients 1 10 50 100] [--sensors 2]
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from storageBenchmark import syntheticFrames
+
+class SyntheticSensor():
+    # Has a new frame every 1/rate seconds, like a live sensor polled by the server
+    def __init__(self, id, frames, rate):
+        self.id = id
+        self.frames = frames
+        self.rate = rate
+        self.start = time.monotonic()
+
+    @property
+    def fc(self):
+        return int((time.monotonic()-self.start)*self.rate)+1
+
+    def latest_frame(self):
+        fc = self.fc
+        return self.frames[fc % len(self.frames)], fc, time.time()
+
+def runServer(port, sensorCount, size, rate, vizOptions, ready):
+    from VizServer import AsyncVizServer
+    frames = syntheticFrames(250, size).reshape(-1, size, size)
+    sensors = [SyntheticSensor(i+1, frames, rate) for i in range(sensorCount)]
+    async def main():
+        server = AsyncVizServer(sensors, vizOptions, host="127.0.0.1", port=port)
+        serving = asyncio.create_task(server.serve(asyncio.Event()))
+        await asyncio.sleep(0.2)
+        ready.set()
+        await serving
+    asyncio.run(main())
+
+async def runClient(port, counts, index):
+    from tornado.websocket import websocket_connect
+    connection = await websocket_connect(f"ws://127.0.0.1:{port}/socket.io/?EIO=4&transport=websocket")
+    try:
+        await connection.write_message("40")
+        ackId = None
+        while True:
+            message = await connection.read_message()
+            if message is None:
+                return
+            if isinstance(message, bytes):
+                # Attachment of a sensor_data event, acknowledged once received
+                counts[index] += 1
+                if ackId is not None:
+                    await connection.write_message(f"43{ackId}[]")
+                    ackId = None
+            elif message == "2":
+                await connection.write_message("3")
+            elif message.startswith("45"):
+                # Binary event header: 45<attachments>-<ack id>["sensor_data", placeholder]
+                ackId = message[2:message.index('[')].split('-')[1] or None
+    finally:
+        connection.close()
+
+async def measure(port, clientCount, duration, serverProcess):
+    counts = [0]*clientCount
+    clients = [asyncio.create_task(runClient(port, counts, i)) for i in range(clientCount)]
+    await asyncio.sleep(1.0)
+    before = list(counts)
+    serverProcess.cpu_percent()
+    await asyncio.sleep(duration)
+    received = np.array(counts)-np.array(before)
+    cpu = serverProcess.cpu_percent()
+    for client in clients:
+        client.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    await asyncio.sleep(0.5)
+    return received/duration, cpu
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 25, 50, 100])
+    parser.add_argument("--sensors", type=int, default=2)
+    parser.add_argument("--size", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=50)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--codec", default=None)
+    parser.add_argument("--port", type=int, default=5329)
+    args = parser.parse_args()
+    import psutil
+    vizOptions = {'maxRate': args.rate, 'codec': args.codec}
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=runServer, args=(args.port, args.sensors, args.size, args.rate, vizOptions, ready), daemon=True)
+    process.start()
+    ready.wait()
+    serverProcess = psutil.Process(process.pid)
+    print(f"{args.sensors} sensors of {args.size}x{args.size} at {args.rate:.0f} fps, codec {args.codec}")
+    print(f"{'clients':>8}{'mean fps':>10}{'min fps':>10}{'server CPU %':>14}{'sustained':>11}")
+    for clientCount in args.clients:
+        fps, cpu = asyncio.run(measure(args.port, clientCount, args.duration, serverProcess))
+        sustained = "yes" if fps.min() >= 0.95*args.rate else "no"
+        print(f"{clientCount:>8}{fps.mean():>10.1f}{fps.min():>10.1f}{cpu:>14.0f}{sustained:>11}")
+    process.terminate()
@@ -1,35 +1,338 @@
-from flask import Flask
+from flask import Flask, request
 import json
 from flask_socketio import SocketIO
 from flask_cors import CORS
 import time
+import struct
+import threading
 import numpy as np
+from StreamCodec import quantize, encodeDelta
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}}) 
+CORS(app, resources={r"/*": {"origins": "*"}})
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-def replay_sensors( pressureDict, frameRate, numFrames):
+# Binary sensor_data messages hold one record per sensor: a header (sensor id, frame count, rows, cols, dtype code)
+# followed by rows*cols little-endian values, uint16 readings for grids and float32 for aggregates. With the delta
+# codec, grids are instead a keyframe or delta (dtype 3 or 4): a uint32 payload length and a zlib payload of
+# rows*cols uint8 levels (StreamCodec). The "json" transport sends the old nested-list JSON instead.
+FRAME_HEADER = struct.Struct('<HIHHBx')
+PAYLOAD_LENGTH = struct.Struct('<I')
+DTYPE_UINT16 = 1
+DTYPE_FLOAT32 = 2
+DTYPE_UINT8_KEYFRAME = 3
+DTYPE_UINT8_DELTA = 4
+
+AGGREGATES = ('sum', 'max', 'cop')
+FULL_VIEW = (None, 1, None)
+
+def encode_frames(frames):
+    # frames: (sensorId, frame count, 2D values) for each sensor in the message
+    parts = []
+    for sensorId, fc, pressure in frames:
+        rows, cols = pressure.shape
+        if pressure.dtype == np.float32:
+            parts.append(FRAME_HEADER.pack(sensorId, fc & 0xFFFFFFFF, rows, cols, DTYPE_FLOAT32))
+            parts.append(pressure.astype('<f4').tobytes())
+        else:
+            parts.append(FRAME_HEADER.pack(sensorId, fc & 0xFFFFFFFF, rows, cols, DTYPE_UINT16))
+            parts.append(np.clip(pressure, 0, 65535).astype('<u2').tobytes())
+    return b''.join(parts)
+
+def parse_subscription(options):
+    # options: {"sensors": [ids], "roi": [rowStart, colStart, rowEnd, colEnd], "downsample": n, "aggregate": mode},
+    # every key optional. Returns (set of sensor ids or None for all, view), where a view is the hashable
+    # (roi, downsample, aggregate) that clients with the same request share.
+    sensors = options.get('sensors')
+    roi = options.get('roi')
+    downsample = int(options.get('downsample', 1))
+    aggregate = options.get('aggregate')
+    if roi is not None:
+        roi = tuple(int(value) for value in roi)
+        if len(roi) != 4 or min(roi) < 0 or roi[0] >= roi[2] or roi[1] >= roi[3]:
+            raise ValueError(f"roi must be [rowStart, colStart, rowEnd, colEnd], got {options.get('roi')}")
+    if downsample < 1:
+        raise ValueError(f"downsample must be at least 1, got {downsample}")
+    if aggregate is not None and aggregate not in AGGREGATES:
+        raise ValueError(f"aggregate must be one of {AGGREGATES}, got '{aggregate}'")
+    return (None if sensors is None else set(int(sensorId) for sensorId in sensors)), (roi, downsample, aggregate)
+
+def render_view(pressure, view):
+    # The part of a frame a view asks for: the ROI, averaged over downsample x downsample blocks (edge blocks may be
+    # smaller), or one aggregate of the ROI as float32 (center of pressure is (row, col) in full-frame coordinates)
+    roi, downsample, aggregate = view
+    rowStart, colStart = (0, 0) if roi is None else roi[:2]
+    if roi is not None:
+        pressure = pressure[roi[0]:roi[2], roi[1]:roi[3]]
+    if aggregate == 'sum':
+        return np.array([[pressure.sum()]], dtype=np.float32)
+    if aggregate == 'max':
+        return np.array([[pressure.max(initial=0)]], dtype=np.float32)
+    if aggregate == 'cop':
+        total = pressure.sum()
+        if total <= 0:
+            return np.full((1, 2), np.nan, dtype=np.float32)
+        rows, cols = np.indices(pressure.shape)
+        return np.array([[rowStart+(rows*pressure).sum()/total, colStart+(cols*pressure).sum()/total]], dtype=np.float32)
+    if downsample > 1:
+        rowBlocks = np.arange(0, pressure.shape[0], downsample)
+        colBlocks = np.arange(0, pressure.shape[1], downsample)
+        sums = np.add.reduceat(np.add.reduceat(pressure, rowBlocks, axis=0), colBlocks, axis=1)
+        counts = np.outer(np.diff(np.append(rowBlocks, pressure.shape[0])), np.diff(np.append(colBlocks, pressure.shape[1])))
+        pressure = np.rint(sums/counts)
+    return pressure
+
+class VizClient():
+    # Send state of one connected browser: its own frame interval, the frame count it last received per sensor,
+    # and how many messages it has not acknowledged yet
+    def __init__(self, sid, rate):
+        self.sid = sid
+        self.interval = 1/rate
+        self.nextSend = 0.0
+        self.inFlight = 0
+        self.lastSent = 0.0
+        self.frameCounts = {}
+        self.skipped = 0
+        self.sensors = None # sensor ids this client subscribed to, None for all
+        self.view = FULL_VIEW
+        self.references = {} # delta codec: sensorId -> (frame count, quantized frame, deltas since keyframe)
+
+    def acked(self, *args):
+        self.inFlight = max(self.inFlight-1, 0)
+
+class VizEmitter():
+    # Sends each client only the sensors whose frame changed since its last message, always the latest frame.
+    # A client is sent at most its own rate, and is skipped while maxInFlight messages are unacknowledged, so a slow
+    # link drops intermediate frames for that client alone instead of backing up the queue for everyone.
+    # Clients may subscribe to some sensors and a view of them; each (sensor, view) record is computed once per frame
+    # and shared by every client subscribed to it.
+    # send(client, message) delivers a sensor_data message; ready(client), when given, can hold a client back as well,
+    # e.g. while its send queue is full.
+    # publish and pump run on one thread; connect, disconnect, setRate and subscribe may be called from others.
+    def __init__(self, send, ready=None, transport="binary", maxRate=50, maxInFlight=2, ackTimeout=1.0, codec=None,
+                 quantization=None, keyframeInterval=50, compressionLevel=1):
+        self.send = send
+        self.ready = ready
+        self.transport = transport
+        self.maxRate = maxRate
+        self.maxInFlight = maxInFlight
+        self.ackTimeout = ackTimeout
+        self.codec = codec
+        self.quantization = quantization or {}
+        self.keyframeInterval = keyframeInterval
+        self.compressionLevel = compressionLevel
+        self.frames = {} # sensorId -> (frame count, frame)
+        self.records = {} # (sensorId, view) -> (frame count, encoded record)
+        self.encoded = {} # delta codec: (sensorId, view) -> (frame count, quantized frame, {reference fc: record})
+        self.clients = {}
+        self.subscriptions = {} # sid -> (sensors, view) requested but not yet applied by pump
+        self.rates = {} # sid -> rate requested but not yet applied by pump
+        self.lock = threading.Lock()
+
+    def configure(self, vizOptions):
+        self.transport = vizOptions.get('transport', "binary")
+        self.maxRate = vizOptions.get('maxRate', 50)
+        self.maxInFlight = vizOptions.get('maxInFlight', 2)
+        self.codec = vizOptions.get('codec')
+        self.quantization = vizOptions.get('quantization', {})
+        self.keyframeInterval = vizOptions.get('keyframeInterval', 50)
+        self.compressionLevel = vizOptions.get('compressionLevel', 1)
+
+    def codecOptions(self):
+        # What a new client needs to decode the stream (sent as viz_codec), None without a codec
+        if self.codec is None:
+            return None
+        return {'codec': self.codec, **self.quantization}
+
+    def connect(self, sid):
+        with self.lock:
+            self.clients[sid] = VizClient(sid, self.maxRate)
+
+    def disconnect(self, sid):
+        with self.lock:
+            self.clients.pop(sid, None)
+            self.subscriptions.pop(sid, None)
+            self.rates.pop(sid, None)
+
+    def setRate(self, sid, rate):
+        # Called from Socket.IO handlers; like subscribe, the change is applied by pump
+        if rate > 0:
+            with self.lock:
+                self.rates[sid] = rate
+
+    def subscribe(self, sid, sensors, view):
+        # Called from Socket.IO handlers; the change is applied by pump, the only place clients and records are used
+        with self.lock:
+            self.subscriptions[sid] = (sensors, view)
+
+    def applyRequests(self):
+        # Applies the rates and subscriptions queued by setRate and subscribe
+        with self.lock:
+            rates, self.rates = self.rates, {}
+            for sid, rate in rates.items():
+                client = self.clients.get(sid)
+                if client is not None:
+                    client.interval = 1/min(rate, self.maxRate)
+            if not self.subscriptions:
+                return
+            subscriptions, self.subscriptions = self.subscriptions, {}
+            for sid, (sensors, view) in subscriptions.items():
+                client = self.clients.get(sid)
+                if client is not None:
+                    client.sensors = sensors
+                    client.view = view
+                    # Records for the new view have not been sent to this client yet
+                    client.frameCounts = {}
+                    client.references = {}
+            views = set(client.view for client in self.clients.values())
+        self.records = {key: value for key, value in self.records.items() if key[1] in views}
+        self.encoded = {key: value for key, value in self.encoded.items() if key[1] in views}
+
+    def frameCount(self, sensorId):
+        return self.frames[sensorId][0] if sensorId in self.frames else None
+
+    def publish(self, sensorId, fc, pressure):
+        # Keeps a copy of a sensor's new frame; records are encoded from it when a client needs them
+        if sensorId in self.frames and self.frames[sensorId][0] == fc:
+            return
+        self.frames[sensorId] = (fc, np.array(pressure))
+
+    def record(self, sensorId, view):
+        # Encoded record of a sensor's latest frame in a view, computed once per frame however many clients want it
+        fc, pressure = self.frames[sensorId]
+        key = (sensorId, view)
+        if key not in self.records or self.records[key][0] != fc:
+            values = render_view(pressure, view)
+            if self.transport == "json":
+                if values.dtype == np.float32:
+                    values = np.where(np.isnan(values), None, values)
+                record = f'"{sensorId}": {json.dumps(values.tolist())}'
+            else:
+                record = encode_frames([(sensorId, fc, values)])
+            self.records[key] = (fc, record)
+        return self.records[key]
+
+    def codedRecord(self, client, sensorId):
+        # Delta codec record of a sensor's latest frame for one client: a keyframe when the client has no reference
+        # yet or keyframeInterval deltas have been sent since its last one, otherwise the difference from the frame
+        # it was sent last. Clients with the same view and reference share the encoded record.
+        fc, pressure = self.frames[sensorId]
+        key = (sensorId, client.view)
+        if key not in self.encoded or self.encoded[key][0] != fc:
+            self.encoded[key] = (fc, quantize(render_view(pressure, client.view), **self.quantization), {})
+        fc, quantized, records = self.encoded[key]
+        reference = client.references.get(sensorId)
+        keyframe = reference is None or reference[2] >= self.keyframeInterval
+        referenceFc = None if keyframe else reference[0]
+        if referenceFc not in records:
+            rows, cols = quantized.shape
+            payload = encodeDelta(quantized, None if keyframe else reference[1], self.compressionLevel)
+            dtype = DTYPE_UINT8_KEYFRAME if keyframe else DTYPE_UINT8_DELTA
+            records[referenceFc] = FRAME_HEADER.pack(sensorId, fc & 0xFFFFFFFF, rows, cols, dtype)+PAYLOAD_LENGTH.pack(len(payload))+payload
+        client.references[sensorId] = (fc, quantized, 0 if keyframe else reference[2]+1)
+        return records[referenceFc]
+
+    def clientRecord(self, client, sensorId):
+        if self.codec == "delta" and self.transport != "json" and client.view[2] is None:
+            return self.codedRecord(client, sensorId)
+        return self.record(sensorId, client.view)[1]
+
+    def poll(self, allSensors):
+        # Publishes the sensors that have a new frame, then sends clients what they are due
+        for sensor in allSensors:
+            if sensor.fc == self.frameCount(sensor.id):
+                continue
+            pressure, fc, ts = sensor.latest_frame()
+            self.publish(sensor.id, fc, pressure)
+        self.pump()
+
+    def pump(self):
+        if self.subscriptions or self.rates:
+            self.applyRequests()
+        now = time.monotonic()
+        with self.lock:
+            clients = list(self.clients.values())
+        for client in clients:
+            if now < client.nextSend or (self.ready is not None and not self.ready(client)):
+                continue
+            if client.inFlight >= self.maxInFlight:
+                if now-client.lastSent < self.ackTimeout:
+                    client.skipped += 1
+                    continue
+                # Acknowledgements were lost (or the page does not send them); start counting again
+                client.inFlight = 0
+            changed = [(sensorId, fc) for sensorId, (fc, pressure) in self.frames.items()
+                       if client.frameCounts.get(sensorId) != fc and (client.sensors is None or sensorId in client.sensors)]
+            if not changed:
+                continue
+            records = [self.clientRecord(client, sensorId) for sensorId, fc in changed]
+            if self.transport == "json":
+                message = '{'+', '.join(records)+'}'
+            else:
+                message = b''.join(records)
+            client.inFlight += 1
+            client.lastSent = now
+            # Keeps the client's send phase when sends are on time, without bursting to catch up after a stall
+            client.nextSend = (client.nextSend if now-client.nextSend < client.interval else now)+client.interval
+            for sensorId, fc in changed:
+                client.frameCounts[sensorId] = fc
+            self.send(client, message)
+
+emitter = VizEmitter(lambda client, message: socketio.emit('sensor_data', message, to=client.sid, callback=client.acked))
+
+@socketio.on('connect')
+def on_connect():
+    emitter.connect(request.sid)
+    codecOptions = emitter.codecOptions()
+    if codecOptions is not None:
+        # Range the page needs to turn 8-bit levels back into readings
+        socketio.emit('viz_codec', codecOptions, to=request.sid)
+
+@socketio.on('disconnect')
+def on_disconnect():
+    emitter.disconnect(request.sid)
+
+@socketio.on('viz_rate')
+def on_viz_rate(rate):
+    # Lets a client ask for fewer frames per second than vizOptions.maxRate, e.g. a phone on Wi-Fi
+    emitter.setRate(request.sid, float(rate))
+
+@socketio.on('subscribe')
+def on_subscribe(options):
+    # Narrows what this client is sent, e.g. {"sensors": [2], "roi": [0, 0, 16, 16], "downsample": 2} or
+    # {"aggregate": "cop"}. An empty subscription goes back to every sensor's full frame.
+    try:
+        sensors, view = parse_subscription(options or {})
+    except (TypeError, ValueError) as e:
+        return {'error': str(e)}
+    emitter.subscribe(request.sid, sensors, view)
+    return {'ok': True}
+
+def configure_emitter(vizOptions):
+    emitter.configure(vizOptions or {})
+
+def publish_batch(vizEmitter, batch, frameCounts):
+    # Publishes a batch of replayed (ts, sensorId, frame) and sends it; frames are counted per sensor in frameCounts
+    for ts, sensorId, pressure in batch:
+        frameCounts[sensorId] = frameCounts.get(sensorId, 0)+1
+        vizEmitter.publish(sensorId, frameCounts[sensorId], pressure)
+    vizEmitter.pump()
+
+def replay_sensors(batches, vizOptions=None):
+    # batches yields lists of (ts, sensorId, frame) when they are due (Replay.pace)
+    configure_emitter(vizOptions)
     with app.app_context():
-        for i in range(numFrames):
-            sensors={}
-            for j in pressureDict:
-                pressure=pressureDict[j][i]
-                sensors[j]= (pressure).tolist()
-            jsonSensors = json.dumps(sensors)
-            socketio.emit('sensor_data', jsonSensors)
-            time.sleep(1/frameRate)
-
-def update_sensors(allSensors):
+        frameCounts={}
+        for batch in batches:
+            publish_batch(emitter, batch, frameCounts)
+
+def update_sensors(allSensors, vizOptions=None):
+    # Frame counts are polled at pollRate; clients are only sent sensors that have a new frame
+    configure_emitter(vizOptions)
+    pollInterval = 1/(vizOptions or {}).get('pollRate', 200)
     with app.app_context():
-        sensors={}
         while True:
-            for i in range(len(allSensors)):
-                pressure=allSensors[i].pressure.reshape(allSensors[i].selWires,allSensors[i].readWires)
-                sensors[allSensors[i].id]= (pressure).tolist()
-                
-            jsonSensors = json.dumps(sensors)
-            socketio.emit('sensor_data', jsonSensors)
-            time.sleep(1/50)  # 50 FPS
+            emitter.poll(allSensors)
+            time.sleep(pollInterval)
 
 def start_server():
     socketio.run(app, host="0.0.0.0", port=5328, debug=True, use_reloader=False)
@@ -37,4 +340,4 @@ def start_server():
 
 @app.route('/api/python')
 def index():
-    return "WebSocket server is running..."
\ No newline at end of file
+    return "WebSocket server is running..."
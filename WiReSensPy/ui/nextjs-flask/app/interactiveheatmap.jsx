@@ -249,7 +249,7 @@ const InteractiveHeatmap = ({
       <Colorbar></Colorbar>
       {data.map((row, rowIndex) => (
         <div key={rowIndex} className={styles.row}>
-          {row.map((value, colIndex) => {
+          {Array.from(row, (value, colIndex) => {
             const position = positions[`${rowIndex}-${colIndex}`];
             const nodeId = `${rowIndex}-${colIndex}`;
             return (
@@ -27,6 +27,84 @@ const generateRandomArray = (rows, cols) => {
   return array;
 };
 
+// Binary sensor_data: for each sensor a 12-byte header (uint16 id, uint32 frame count, uint16 rows, uint16 cols,
+// uint8 dtype, 1 byte padding) followed by rows*cols little-endian values: uint16 readings (dtype 1) or float32
+// aggregates (dtype 2). Rows of uint16 grids are views into the message. With the delta codec (vizOptions.codec),
+// grids are a uint32 length and a zlib payload of 8-bit levels: a keyframe (dtype 3) or the difference from the
+// previous frame of that sensor (dtype 4).
+const FRAME_HEADER_BYTES = 12;
+const DTYPE_FLOAT32 = 2;
+const DTYPE_UINT8_KEYFRAME = 3;
+const DTYPE_UINT8_DELTA = 4;
+
+// Delta codec state: the last 8-bit frame of each sensor, and the reading each level stands for
+const codecState = { references: {}, levels: null };
+
+const makeLevels = ({ pressureMin = 0, pressureMax = 4096, useLog = true }) => {
+  const levels = new Float32Array(256);
+  for (let i = 0; i < 256; i++) {
+    levels[i] = useLog
+      ? pressureMin + Math.expm1((i / 255) * Math.log1p(pressureMax - pressureMin))
+      : pressureMin + (i / 255) * (pressureMax - pressureMin);
+  }
+  return levels;
+};
+
+const inflate = async (bytes) => {
+  const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("deflate"));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+};
+
+const decodeCodedFrame = async (id, buffer, offset, length, dtype) => {
+  const levels = await inflate(new Uint8Array(buffer, offset, length));
+  if (dtype === DTYPE_UINT8_DELTA) {
+    // Uint8Array stores wrap modulo 256, matching the server's uint8 difference
+    const reference = codecState.references[id];
+    for (let i = 0; i < levels.length; i++) {
+      levels[i] += reference[i];
+    }
+  }
+  codecState.references[id] = levels;
+  const table = codecState.levels || makeLevels({});
+  return Float32Array.from(levels, (level) => table[level]);
+};
+
+const decodeSensorFrames = async (data) => {
+  const buffer =
+    data instanceof ArrayBuffer
+      ? data
+      : data.buffer.slice(data.byteOffset, data.byteOffset + data.byteLength);
+  const view = new DataView(buffer);
+  const sensors = {};
+  let offset = 0;
+  while (offset + FRAME_HEADER_BYTES <= buffer.byteLength) {
+    const id = view.getUint16(offset, true);
+    const rows = view.getUint16(offset + 6, true);
+    const cols = view.getUint16(offset + 8, true);
+    const dtype = view.getUint8(offset + 10);
+    offset += FRAME_HEADER_BYTES;
+    let values;
+    if (dtype === DTYPE_UINT8_KEYFRAME || dtype === DTYPE_UINT8_DELTA) {
+      const length = view.getUint32(offset, true);
+      values = await decodeCodedFrame(id, buffer, offset + 4, length, dtype);
+      offset += 4 + length;
+    } else if (dtype === DTYPE_FLOAT32) {
+      // Float32 records are not necessarily 4-byte aligned within the message, so they are copied out
+      values = new Float32Array(buffer.slice(offset, offset + rows * cols * 4));
+      offset += rows * cols * 4;
+    } else {
+      values = new Uint16Array(buffer, offset, rows * cols);
+      offset += rows * cols * 2;
+    }
+    const grid = [];
+    for (let row = 0; row < rows; row++) {
+      grid.push(values.subarray(row * cols, (row + 1) * cols));
+    }
+    sensors[id] = grid;
+  }
+  return sensors;
+};
+
 const Home = () => {
   let defaultSensors = {};
   WiSensConfig.sensors.map((sensorConfig) => {
@@ -55,19 +133,48 @@ const Home = () => {
   const sensorDivRef = useRef(null);
 
   useEffect(() => {
-    const handleSensorData = (data) => {
-      let dataObj = JSON.parse(data);
-      setSensors(dataObj);
+    // Messages are decoded one after another, since codec deltas apply to the previous message's frames
+    let decoding = Promise.resolve();
+    const handleSensorData = (data, ack) => {
+      decoding = decoding
+        .then(async () => {
+          // JSON strings come from the "json" viz transport, everything else is the binary format
+          let dataObj =
+            typeof data === "string" ? JSON.parse(data) : await decodeSensorFrames(data);
+          setSensors((prevSensors) => ({ ...prevSensors, ...dataObj }));
+        })
+        .catch((error) => console.error("Could not decode sensor data", error))
+        .then(() => {
+          // The server holds back further frames for this page until earlier ones are acknowledged
+          if (typeof ack === "function") {
+            ack();
+          }
+        });
     };
 
     socket.on("connect", () => {
       console.log("Connected to server");
+      // ?fps=N asks the server for at most N frames per second on this page
+      const fps = new URLSearchParams(window.location.search).get("fps");
+      if (fps) {
+        socket.emit("viz_rate", Number(fps));
+      }
+      // ?sensors=1,2 only streams those sensors, e.g. for a phone showing one of them
+      const subscribed = new URLSearchParams(window.location.search).get("sensors");
+      if (subscribed) {
+        socket.emit("subscribe", { sensors: subscribed.split(",").map(Number) });
+      }
     });
 
     socket.on("disconnect", () => {
       console.log("Disconnected from server");
     });
 
+    socket.on("viz_codec", (options) => {
+      codecState.levels = makeLevels(options);
+      codecState.references = {};
+    });
+
     socket.on("sensor_data", handleSensorData);
     socket.on("step", (count) => {
       setStepCount(count);
@@ -75,6 +182,7 @@ const Home = () => {
 
     return () => {
       socket.off("sensor_data", handleSensorData);
+      socket.off("viz_codec");
     };
   }, []);
 
@@ -6,18 +6,106 @@ import serial
 import datetime
 from datetime import datetime
 import subprocess
+from RecordingReader import RecordingReader, recordingSegments
+import os
+import time
 
 
 def tactile_reading(path):
-    f = h5py.File(path, 'r')
-    fc = f['frame_count'][0]
-    ts = np.array(f['ts'][:fc])
-    pressure = np.array(f['pressure'][:fc]).astype(np.float32)
+    # path is an HDF5 recording or the manifest of a segmented one. This loads the whole recording; use
+    # RecordingReader to read a window or to iterate over a long recording in chunks.
+    with RecordingReader(path) as reader:
+        pressure, ts = reader.read()
+    fc = len(ts)
 
     return pressure, fc, ts
 
+class TactileTail():
+    # Keeps a recording open in SWMR read mode and returns only the frames added since the previous poll.
+    # For a segmented recording (manifest path), it moves on to the next segment once the current one is complete.
+    def __init__(self, path):
+        self.path = path
+        self.segment = 0
+        self.file = None
+        self.shape = (0, 0)
+        if not self.openSegment():
+            raise OSError(f"No segments listed in {path}")
+
+    def openSegment(self):
+        segments = recordingSegments(self.path)
+        if self.segment >= len(segments):
+            return False
+        segmentPath, self.firstFrame, self.segmentFrames = segments[self.segment]
+        self.file = h5py.File(segmentPath, 'r', libver='latest', swmr=True)
+        self.frameCount = self.file['frame_count']
+        self.ts = self.file['ts']
+        self.pressure = self.file['pressure']
+        self.shape = self.pressure.shape[1:]
+        self.fc = 0
+        return True
+
+    def poll(self):
+        # Returns (pressure, ts, index of the first returned frame); empty arrays if nothing new was recorded
+        if self.file is None and not self.openSegment():
+            return np.empty((0,)+self.shape, dtype=np.float32), np.empty(0), self.firstFrame+self.fc
+        self.frameCount.refresh()
+        fc = int(self.frameCount[0])
+        first = self.fc
+        if fc <= first:
+            if self.path.endswith('.json') and self.segmentComplete():
+                self.file.close()
+                self.file = None
+                self.segment += 1
+                if self.openSegment():
+                    return self.poll()
+            return np.empty((0,)+self.shape, dtype=np.float32), np.empty(0), self.firstFrame+first
+        self.ts.refresh()
+        self.pressure.refresh()
+        ts = self.ts[first:fc]
+        pressure = self.pressure[first:fc].astype(np.float32)
+        self.fc = fc
+        return pressure, ts, self.firstFrame+first
+
+    def segmentComplete(self):
+        # The manifest records a segment's frame count when the writer closes it
+        if self.segmentFrames is None:
+            self.segmentFrames = recordingSegments(self.path)[self.segment][2]
+        return self.segmentFrames is not None and self.fc >= self.segmentFrames
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+def tactile_follow(path, pollInterval=0.05, stopEvent=None):
+    # Yields (pressure, ts, first frame index) blocks as they are recorded, until stopEvent is set
+    while not os.path.exists(path):
+        if stopEvent is not None and stopEvent.is_set():
+            return
+        time.sleep(pollInterval)
+    tail = None
+    try:
+        while stopEvent is None or not stopEvent.is_set():
+            if tail is None:
+                try:
+                    tail = TactileTail(path)
+                except OSError:
+                    # The writer has created the file but not switched it to SWMR mode yet
+                    time.sleep(pollInterval)
+                    continue
+            pressure, ts, first = tail.poll()
+            if len(ts) > 0:
+                yield pressure, ts, first
+            else:
+                time.sleep(pollInterval)
+    finally:
+        if tail is not None:
+            tail.close()
+
 def find_closest_index(array, value):
-    index = (np.abs(array - value)).argmin()
+    # array is sorted (recording timestamps), so the closest value is found by binary search
+    index = int(np.searchsorted(array, value))
+    if index == len(array) or (index > 0 and value-array[index-1] <= array[index]-value):
+        index -= 1
     return index, array[index]
 
 def getUnixTimestamp():